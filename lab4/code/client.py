@@ -1,43 +1,505 @@
 import socket
 import sys
+import time
+import json
+import math
+import argparse
+import os
+import queue
+from collections import Counter
+from threading import Thread, Lock
+
+# Границы корзин гистограммы задержек, мс
+HISTOGRAM_BUCKETS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+RECV_SIZE = 65536
+
+def request_target(filename):
+    # Полный URL (http://...) отправляем как есть - так запрос понимает прокси из lab7
+    return filename if filename.startswith('http://') else f'/{filename.lstrip("/")}'
+
+def build_request(host, port, filename, keep_alive=False, extra_headers=()):
+    target = request_target(filename)
+    connection = 'keep-alive' if keep_alive else 'close'
+    headers = ''.join(f'{header}\r\n' for header in extra_headers)
+    return f'GET {target} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: {connection}\r\n{headers}\r\n'.encode()
 
 def send_request(host, port, filename):
     try:
         # Создаем TCP соединение
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client_socket.connect((host, int(port)))
-        
+
         # Формируем HTTP запрос
-        request = f'GET /{filename} HTTP/1.1\r\nHost: {host}\r\n\r\n'
-        
+        request = f'GET /{filename} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'
+
         # Отправляем запрос
-        client_socket.send(request.encode())
-        
-        # Получаем ответ
-        response = b''
+        client_socket.sendall(request.encode())
+
+        # Получаем ответ: recv_into в один буфер и дописывание в bytearray без копирования всего ответа
+        response = bytearray()
+        chunk = memoryview(bytearray(RECV_SIZE))
         while True:
-            data = client_socket.recv(1024)
-            if not data:
+            received = client_socket.recv_into(chunk)
+            if not received:
                 break
-            response += data
-            
+            response += chunk[:received]
+
         # Закрываем соединение
         client_socket.close()
-        
+
         # Декодируем и выводим ответ
         print(response.decode('utf-8', errors='ignore'))
-        
+
     except Exception as e:
         print(f'Ошибка: {e}')
         sys.exit(1)
 
+class HTTPConnection:
+    """Постоянное соединение с сервером; ответы читаются через recv_into в переиспользуемый буфер"""
+    def __init__(self, host, port, timeout=10):
+        self.sock = socket.create_connection((host, int(port)), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buf = bytearray()  # Заголовки и байты, пришедшие сверх текущего ответа
+        self.chunk = memoryview(bytearray(RECV_SIZE))
+
+    def send(self, request):
+        self.sock.sendall(request)
+
+    def read_response(self, sink=None, on_headers=None):
+        """
+        Читает один HTTP-ответ
+        :param sink: функция, получающая тело по частям (memoryview/bytes); None - тело отбрасывается
+        :param on_headers: функция (код, заголовки), вызываемая до чтения тела; ее результат заменяет sink
+        :return: (код ответа, заголовки, длина тела, нужно ли закрыть соединение)
+        """
+        while True:
+            end = self.buf.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            received = self.sock.recv_into(self.chunk)
+            if not received:
+                raise ConnectionError('Соединение закрыто до получения заголовков')
+            self.buf += self.chunk[:received]
+
+        lines = self.buf[:end].decode('latin-1').split('\r\n')
+        del self.buf[:end + 4]
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        close = headers.get('connection', '').lower() == 'close'
+        if on_headers:
+            sink = on_headers(status, headers)
+
+        if status in (204, 304) or 100 <= status < 200:
+            return status, headers, 0, close
+
+        if 'content-length' not in headers:
+            # Без Content-Length тело идет до закрытия соединения
+            length = self.take_buffered(len(self.buf), sink)
+            while True:
+                received = self.sock.recv_into(self.chunk)
+                if not received:
+                    return status, headers, length, True
+                if sink:
+                    sink(self.chunk[:received])
+                length += received
+
+        length = int(headers['content-length'])
+        remaining = length - self.take_buffered(min(len(self.buf), length), sink)
+        while remaining > 0:
+            # Читаем не больше, чем осталось от тела, чтобы не захватить следующий ответ
+            received = self.sock.recv_into(self.chunk, min(RECV_SIZE, remaining))
+            if not received:
+                raise ConnectionError('Соединение закрыто до получения всего тела')
+            if sink:
+                sink(self.chunk[:received])
+            remaining -= received
+        return status, headers, length, close
+
+    def take_buffered(self, count, sink):
+        """Отдает в sink начало тела, прочитанное вместе с заголовками"""
+        if count and sink:
+            sink(bytes(self.buf[:count]))
+        del self.buf[:count]
+        return count
+
+    def close(self):
+        self.sock.close()
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class LoadTester:
+    """Нагрузочный тест: несколько потоков шлют запросы и замеряют задержку каждого"""
+    def __init__(self, host, port, filename, concurrency=10, requests=None, duration=None,
+                 keep_alive=True, timeout=10):
+        self.host = host
+        self.port = int(port)
+        self.filename = filename
+        self.concurrency = concurrency
+        self.requests = requests  # Общее число запросов или None, если тест ограничен временем
+        self.duration = duration
+        self.keep_alive = keep_alive  # Переиспользовать соединение или открывать новое на каждый запрос
+        self.timeout = timeout
+        self.request = build_request(host, port, filename, keep_alive)
+
+        self.lock = Lock()
+        self.issued = 0
+        self.deadline = None
+        self.latencies = []  # Задержки успешных запросов, мс
+        self.status_codes = Counter()
+        self.errors = Counter()
+        self.bytes_received = 0
+        self.connections = 0
+
+    def take_ticket(self):
+        """Разрешает потоку отправить еще один запрос, пока не исчерпан лимит запросов или времени"""
+        if self.requests is None:
+            return time.perf_counter() < self.deadline
+        with self.lock:
+            if self.issued >= self.requests:
+                return False
+            self.issued += 1
+            return True
+
+    def worker(self):
+        latencies = []
+        status_codes = Counter()
+        errors = Counter()
+        bytes_received = 0
+        connections = 0
+        conn = None
+
+        while self.take_ticket():
+            start = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = HTTPConnection(self.host, self.port, self.timeout)
+                    connections += 1
+                conn.send(self.request)
+                status, _, length, close = conn.read_response()
+            except (OSError, ValueError, IndexError) as e:
+                errors[type(e).__name__] += 1
+                if conn:
+                    conn.close()
+                    conn = None
+                continue
+
+            latencies.append((time.perf_counter() - start) * 1000)
+            status_codes[status] += 1
+            bytes_received += length
+            if close or not self.keep_alive:
+                conn.close()
+                conn = None
+
+        if conn:
+            conn.close()
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.status_codes.update(status_codes)
+            self.errors.update(errors)
+            self.bytes_received += bytes_received
+            self.connections += connections
+
+    def run(self):
+        threads = [Thread(target=self.worker, daemon=True) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        if self.duration is not None:
+            self.deadline = started + self.duration
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        histogram = []
+        bucket = 0
+        for bound in HISTOGRAM_BUCKETS + [math.inf]:
+            count = 0
+            while bucket < len(latencies) and latencies[bucket] <= bound:
+                count += 1
+                bucket += 1
+            histogram.append({'le_ms': None if bound == math.inf else bound, 'count': count})
+
+        return {
+            'target': f'{self.host}:{self.port} {request_target(self.filename)}',
+            'concurrency': self.concurrency,
+            'keep_alive': self.keep_alive,
+            'elapsed_s': round(elapsed, 3),
+            'requests_ok': len(latencies),
+            'errors': dict(self.errors),
+            'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+            'connections_opened': self.connections,
+            'bytes_received': self.bytes_received,
+            'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'throughput_mbps': round(self.bytes_received * 8 / elapsed / 1e6, 2) if elapsed else 0.0,
+            'latency_ms': {
+                'min': round(latencies[0], 3) if latencies else 0.0,
+                'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                'p50': round(percentile(latencies, 50), 3),
+                'p90': round(percentile(latencies, 90), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(latencies[-1], 3) if latencies else 0.0
+            },
+            'histogram': histogram
+        }
+
+def print_report(report):
+    print(f'Цель: {report["target"]}, потоков: {report["concurrency"]}, '
+          f'keep-alive: {"да" if report["keep_alive"] else "нет"}')
+    print(f'Успешных запросов: {report["requests_ok"]} за {report["elapsed_s"]} с, '
+          f'ошибок: {sum(report["errors"].values())} {report["errors"] or ""}')
+    print(f'Коды ответов: {report["status_codes"]}, открыто соединений: {report["connections_opened"]}')
+    print(f'Пропускная способность: {report["throughput_rps"]} запр/с, {report["throughput_mbps"]} Мбит/с')
+    latency = report['latency_ms']
+    print(f'Задержка, мс: min={latency["min"]} mean={latency["mean"]} p50={latency["p50"]} '
+          f'p90={latency["p90"]} p99={latency["p99"]} max={latency["max"]}')
+
+    print('Гистограмма задержек:')
+    peak = max((row['count'] for row in report['histogram']), default=0) or 1
+    for row in report['histogram']:
+        if not row['count']:
+            continue
+        label = f'<= {row["le_ms"]} мс' if row['le_ms'] is not None else '> 5000 мс'
+        print(f'  {label:>12} {row["count"]:>8} {"#" * max(1, round(40 * row["count"] / peak))}')
+
+class FileDownload:
+    """Состояние скачивания одного файла, который может собираться из нескольких диапазонов"""
+    def __init__(self, filename, path):
+        self.filename = filename
+        self.path = path
+        self.fd = None
+        self.size = 0
+        self.etag = None
+        self.segments = 1
+        self.pending = 1  # Сколько диапазонов еще не записано
+        self.error = None
+        self.lock = Lock()
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def create(self, size):
+        # Выделяем файл нужного размера сразу - диапазоны пишутся в него по своим смещениям
+        self.size = size
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self.fd, size)
+
+    def writer(self, offset):
+        """Возвращает sink, записывающий тело ответа в файл начиная с offset"""
+        def sink(data):
+            nonlocal offset
+            while data:
+                written = os.pwrite(self.fd, data, offset)
+                offset += written
+                data = data[written:]
+        return sink
+
+    def add_segments(self, count):
+        with self.lock:
+            self.segments += count
+            self.pending += count
+
+    def segment_done(self, error=None):
+        with self.lock:
+            if error and not self.error:
+                self.error = error
+            self.pending -= 1
+            if self.pending:
+                return
+        if self.fd is not None:
+            os.close(self.fd)
+        self.elapsed = time.perf_counter() - self.started
+
+class Downloader:
+    """Скачивает список файлов через пул постоянных соединений, большие файлы - параллельно по диапазонам"""
+    def __init__(self, host, port, filenames, output_dir='.', connections=4, segment_size=1024 * 1024,
+                 timeout=10, retries=2):
+        self.host = host
+        self.port = int(port)
+        self.filenames = filenames
+        self.output_dir = output_dir
+        self.connections = connections
+        self.segment_size = segment_size  # Размер диапазона, которым качаются большие файлы
+        self.timeout = timeout
+        self.retries = retries  # Сколько раз повторять диапазон после сетевой ошибки
+        self.tasks = queue.Queue()
+        self.downloads = []
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        started = time.perf_counter()
+        for filename in self.filenames:
+            path = os.path.join(self.output_dir, os.path.basename(filename.rstrip('/')) or 'index.html')
+            download = FileDownload(filename, path)
+            self.downloads.append(download)
+            # Первый диапазон одновременно сообщает размер файла
+            self.tasks.put((download, 0, self.segment_size - 1, 0))
+
+        threads = [Thread(target=self.worker, daemon=True) for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        self.tasks.join()
+        for _ in threads:
+            self.tasks.put(None)
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def worker(self):
+        conn = None
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                break
+
+            download, start, end, attempt = task
+            try:
+                if conn is None:
+                    conn = HTTPConnection(self.host, self.port, self.timeout)
+                close = self.fetch(conn, download, start, end)
+                if close:
+                    conn.close()
+                    conn = None
+                download.segment_done()
+            except (OSError, ValueError, IndexError) as e:
+                if conn:
+                    conn.close()
+                    conn = None
+                # Сетевую ошибку пробуем пережить повтором диапазона на новом соединении
+                if isinstance(e, OSError) and attempt < self.retries:
+                    self.tasks.put((download, start, end, attempt + 1))
+                else:
+                    download.segment_done(f'{type(e).__name__}: {e}')
+            finally:
+                self.tasks.task_done()
+
+        if conn:
+            conn.close()
+
+    def fetch(self, conn, download, start, end):
+        """Запрашивает диапазон [start, end] и пишет его в файл; возвращает True, если сервер закрывает соединение"""
+        first = download.fd is None
+        headers = [f'Range: bytes={start}-{end}']
+        # If-Range: если файл на сервере изменился, сервер вернет 200 вместо 206 и это будет замечено
+        if download.etag:
+            headers.append(f'If-Range: {download.etag}')
+        conn.send(build_request(self.host, self.port, download.filename, True, headers))
+
+        def on_headers(status, response_headers):
+            if first:
+                return self.start_file(download, status, response_headers)
+            if status != 206 or parse_content_range(response_headers)[0] != start:
+                raise ValueError(f'ожидался 206 для диапазона {start}-{end}, получен {status}')
+            return download.writer(start)
+
+        status, _, _, close = conn.read_response(on_headers=on_headers)
+        if first and download.fd is None:
+            raise ValueError(f'сервер вернул {status}')
+        return close
+
+    def start_file(self, download, status, headers):
+        """Обрабатывает ответ на первый диапазон: выделяет файл и ставит в очередь остальные диапазоны"""
+        if status == 206:
+            start, _, total = parse_content_range(headers)
+            if start != 0:
+                raise ValueError('сервер вернул диапазон не с начала файла')
+            download.create(total)
+            download.etag = headers.get('etag')
+            self.split(download, self.segment_size, total)
+        elif status == 200:
+            # Сервер не поддерживает диапазоны - файл приходит целиком одним ответом
+            download.create(int(headers.get('content-length', 0)))
+        elif status == 416:
+            # Диапазон 0-... невыполним только для пустого файла, тело ответа в файл не пишем
+            download.create(0)
+            return None
+        else:
+            return None
+        return download.writer(0)
+
+    def split(self, download, offset, total):
+        count = 0
+        for start in range(offset, total, self.segment_size):
+            end = min(start + self.segment_size, total) - 1
+            self.tasks.put((download, start, end, 0))
+            count += 1
+        download.add_segments(count)
+
+    def report(self, elapsed):
+        total = 0
+        for download in self.downloads:
+            if download.error:
+                print(f'[!] {download.filename}: ошибка - {download.error}')
+                continue
+            total += download.size
+            took = download.elapsed or elapsed
+            print(f'[*] {download.filename} -> {download.path}: {download.size} байт за {took:.3f} с '
+                  f'({download.size / took / 1e6:.2f} МБ/с, диапазонов: {download.segments})')
+        failed = sum(1 for download in self.downloads if download.error)
+        print(f'[*] Итого: {len(self.downloads) - failed} из {len(self.downloads)} файлов, '
+              f'{total} байт за {elapsed:.3f} с ({total / elapsed / 1e6:.2f} МБ/с), '
+              f'соединений: {self.connections}')
+
+def parse_content_range(headers):
+    """Разбирает Content-Range: bytes start-end/total"""
+    unit, _, spec = headers.get('content-range', '').partition(' ')
+    span, _, total = spec.partition('/')
+    start, _, end = span.partition('-')
+    if unit != 'bytes':
+        raise ValueError('некорректный Content-Range')
+    return int(start), int(end), int(total)
+
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
-        print('Использование: python client.py хост порт имя_файла')
-        sys.exit(1)
-        
-    host = sys.argv[1]
-    port = sys.argv[2]
-    filename = sys.argv[3]
-    
-    send_request(host, port, filename)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(
+        description='HTTP клиент: загрузка одного файла, нагрузочный тест (при указании -n или -d) '
+                    'или скачивание списка файлов (--download)')
+    parser.add_argument('host', help='Хост сервера (или прокси)')
+    parser.add_argument('port', help='Порт')
+    parser.add_argument('filenames', nargs='+', metavar='filename',
+                        help='Имя файла или полный URL http://... для запроса через прокси')
+    parser.add_argument('-c', '--concurrency', type=int, default=10, help='Число параллельных клиентов')
+    parser.add_argument('-n', '--requests', type=int, help='Общее число запросов')
+    parser.add_argument('-d', '--duration', type=float, help='Длительность теста, сек')
+    parser.add_argument('--new-connection', action='store_true',
+                        help='Открывать новое соединение на каждый запрос вместо keep-alive')
+    parser.add_argument('--timeout', type=float, default=10, help='Таймаут сокета, сек')
+    parser.add_argument('--json', help='Сохранить отчет в JSON-файл')
+    parser.add_argument('--download', action='store_true', help='Скачать файлы на диск')
+    parser.add_argument('--output-dir', default='.', help='Каталог для скачанных файлов')
+    parser.add_argument('--connections', type=int, default=4, help='Число параллельных соединений при скачивании')
+    parser.add_argument('--segment-size', type=int, default=1024,
+                        help='Размер диапазона, на которые делятся большие файлы, КБ')
+    args = parser.parse_args()
+
+    if args.download:
+        downloader = Downloader(args.host, args.port, args.filenames, args.output_dir,
+                                args.connections, args.segment_size * 1024, args.timeout)
+        elapsed = downloader.run()
+        downloader.report(elapsed)
+        sys.exit(1 if any(download.error for download in downloader.downloads) else 0)
+
+    if len(args.filenames) != 1:
+        parser.error('несколько файлов поддерживаются только вместе с --download')
+    filename = args.filenames[0]
+
+    if args.requests is None and args.duration is None:
+        send_request(args.host, args.port, filename)
+        sys.exit(0)
+
+    tester = LoadTester(args.host, args.port, filename, args.concurrency,
+                        args.requests, None if args.requests else args.duration,
+                        not args.new_connection, args.timeout)
+    report = tester.run()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
@@ -1,80 +1,1095 @@
 import socket
 import os
-from datetime import datetime
-from threading import Thread
+import errno
+import selectors
+import argparse
+import time
+import signal
+import traceback
+import gzip
+import mimetypes
+import json
+import sys
+import random
+import queue
+from bisect import bisect_left
+from collections import deque, OrderedDict, Counter
+from email.utils import formatdate, parsedate_to_datetime
+from threading import Thread, BoundedSemaphore, Lock, current_thread
+
+MAX_REQUEST_SIZE = 8192  # Максимальный размер заголовков запроса
+MAX_BODY_SIZE = 1024 * 1024  # Максимальный размер тела запроса
+MAX_CHUNK_LINE = 1024  # Максимальная длина строки размера chunk'а и строки трейлера
+RECV_SIZE = 65536
+SEND_CHUNK_SIZE = 65536  # Сколько байт файла отправляем за один вызов
+INLINE_FILE_SIZE = 16384  # Файлы меньше этого размера отправляем одним буфером с заголовками
+MIN_GZIP_SIZE = 256  # Файлы меньше этого размера сжимать не имеет смысла
+# Границы корзин гистограммы задержек, мс
+LATENCY_BUCKETS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+class FileBody:
+    """Тело ответа, которое отправляется из файла по частям, без чтения его в память целиком"""
+    def __init__(self, path, offset, length):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.remaining = length
+        self.use_sendfile = hasattr(os, 'sendfile')
+
+    def send_chunk(self, sock):
+        """Отправляет очередную часть в неблокирующий сокет, возвращает число отправленных байт"""
+        count = min(self.remaining, SEND_CHUNK_SIZE)
+        if self.use_sendfile:
+            try:
+                sent = os.sendfile(sock.fileno(), self.file.fileno(), self.offset, count)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+                # sendfile не поддерживается для этой пары дескрипторов - переходим на чтение блоками
+                self.use_sendfile = False
+                return 0
+        else:
+            self.file.seek(self.offset)
+            sent = sock.send(self.file.read(count))
+
+        if sent == 0 and count > 0:
+            raise OSError(f'Файл {self.file.name} укоротился во время отправки')
+        self.offset += sent
+        self.remaining -= sent
+        return sent
+
+    def send_blocking(self, sock):
+        # socket.sendfile сам использует os.sendfile или откатывается на send блоками
+        sock.sendfile(self.file, self.offset, self.remaining)
+        self.remaining = 0
+
+    def close(self):
+        self.file.close()
+
+def guess_content_type(path):
+    content_type, encoding = mimetypes.guess_type(path)
+    if encoding == 'gzip':
+        return 'application/gzip'
+    if content_type is None or encoding:
+        return 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+        return f'{content_type}; charset=utf-8'
+    return content_type
+
+class Representation:
+    """Одно представление файла: исходное или сжатое gzip"""
+    def __init__(self, path, size, content, etag, entity_headers):
+        self.path = path  # Откуда читать тело, если content не закэширован
+        self.size = size
+        self.content = content
+        self.etag = etag
+        self.entity_headers = entity_headers  # Content-Type, валидаторы и т.п.
+        self.headers = {}  # Готовые заголовки ответа 200 без строки Date, по значению keep_alive
+
+class CachedFile:
+    """Метаданные, валидаторы и (для небольших файлов) содержимое файла и его сжатой версии"""
+    def __init__(self, path, stat, max_content_size):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.mtime = int(stat.st_mtime)
+        self.size = stat.st_size
+        content = None
+        if self.size <= max_content_size:
+            with open(path, 'rb') as f:
+                content = f.read()
+            # Файл мог измениться между stat и чтением - следующий запрос увидит расхождение
+            self.size = len(content)
+
+        self.etag = f'"{self.mtime_ns:x}-{self.size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        content_type = guess_content_type(path)
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+
+        entity_headers = [f'Content-Type: {content_type}']
+        if compressible:
+            entity_headers.append('Vary: Accept-Encoding')
+        self.identity = Representation(path, self.size, content, self.etag,
+                                       entity_headers + [f'ETag: {self.etag}', f'Last-Modified: {self.last_modified}'])
+
+        self.gzip = None
+        if compressible:
+            gzip_etag = f'{self.etag[:-1]}-gz"'
+            gzip_headers = entity_headers + ['Content-Encoding: gzip', f'ETag: {gzip_etag}',
+                                             f'Last-Modified: {self.last_modified}']
+            self.gzip = self.load_gzip(stat, content, max_content_size, gzip_etag, gzip_headers)
+
+        self.cost = 512
+        for representation in (self.identity, self.gzip):
+            if representation and representation.content is not None:
+                self.cost += len(representation.content)
+
+    def load_gzip(self, stat, content, max_content_size, etag, headers):
+        """Берет заранее сжатый соседний файл .gz, если он не старше исходного, иначе сжимает сам"""
+        gzip_path = self.path + '.gz'
+        try:
+            gzip_stat = os.stat(gzip_path)
+        except OSError:
+            gzip_stat = None
+
+        if gzip_stat and gzip_stat.st_mtime_ns >= stat.st_mtime_ns:
+            gzip_content = None
+            if gzip_stat.st_size <= max_content_size:
+                with open(gzip_path, 'rb') as f:
+                    gzip_content = f.read()
+            size = len(gzip_content) if gzip_content is not None else gzip_stat.st_size
+            return Representation(gzip_path, size, gzip_content, etag, headers)
+
+        if content is None or len(content) < MIN_GZIP_SIZE:
+            return None
+        # mtime=0 - одинаковый результат для одного и того же содержимого
+        gzip_content = gzip.compress(content, compresslevel=6, mtime=0)
+        if len(gzip_content) >= len(content):
+            return None
+        return Representation(None, len(gzip_content), gzip_content, etag, headers)
+
+class StaticFileCache:
+    """LRU-кэш файлов с ограничением суммарного объема, записи сбрасываются при смене mtime или размера"""
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_file_size=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size  # Содержимое файлов крупнее этого не кэшируем
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = Lock()
+
+    def get(self, path):
+        """Возвращает актуальную запись для файла, FileNotFoundError если файла нет"""
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                self.entries.move_to_end(path)
+                return entry
+
+        # Читаем файл без блокировки, чтобы не задерживать другие потоки
+        entry = CachedFile(path, stat, self.max_file_size)
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old:
+                self.total_bytes -= old.cost
+            self.entries[path] = entry
+            self.total_bytes += entry.cost
+            while self.total_bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.cost
+        return entry
+
+class HTTPParseError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+class HTTPRequest:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # Имена заголовков в нижнем регистре
+        self.body = b''
+
+class RequestParser:
+    """Инкрементальный разбор HTTP-запросов из буфера соединения, данные могут приходить любыми кусками"""
+    def __init__(self, max_header_size=MAX_REQUEST_SIZE, max_body_size=MAX_BODY_SIZE):
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.reset()
+
+    def reset(self):
+        self.request = None  # Запрос, заголовки которого разобраны, а тело еще нет
+        self.scan_pos = 0  # С какой позиции продолжать поиск конца заголовков
+        self.body = None
+        self.body_remaining = 0
+        self.chunk_state = None  # None - тело по Content-Length, иначе состояние разбора chunked
+
+    def parse(self, buf):
+        """
+        Извлекает из buf следующий полный запрос и удаляет его байты из буфера
+        :return: HTTPRequest или None, если данных пока недостаточно
+        :raises HTTPParseError: запрос некорректен или превышает лимиты
+        """
+        if self.request is None:
+            # Пустые строки перед строкой запроса допускаются и игнорируются
+            while buf.startswith(b'\r\n'):
+                del buf[:2]
+
+            end = buf.find(b'\r\n\r\n', self.scan_pos)
+            if end < 0:
+                if len(buf) > self.max_header_size:
+                    raise HTTPParseError(431, 'Слишком большие заголовки запроса')
+                # Конец заголовков может начаться в последних 3 байтах - их просмотрим еще раз
+                self.scan_pos = max(0, len(buf) - 3)
+                return None
+            if end > self.max_header_size:
+                raise HTTPParseError(431, 'Слишком большие заголовки запроса')
+
+            self.request = self.parse_head(buf[:end])
+            del buf[:end + 4]
+            self.scan_pos = 0
+            self.start_body(self.request.headers)
+
+        if self.chunk_state is None:
+            complete = self.read_fixed_body(buf)
+        else:
+            complete = self.read_chunked_body(buf)
+        if not complete:
+            return None
+
+        request = self.request
+        if self.body:
+            request.body = bytes(self.body)
+        self.reset()
+        return request
+
+    def parse_head(self, head):
+        lines = head.split(b'\r\n')
+        parts = lines[0].split(b' ')
+        if len(parts) != 3 or not parts[2].startswith(b'HTTP/'):
+            raise HTTPParseError(400, 'Некорректная строка запроса')
+
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+            # Пробел перед двоеточием запрещен RFC 7230 - это признак попытки request smuggling
+            if not sep or not name or name != name.strip():
+                raise HTTPParseError(400, 'Некорректная строка заголовка')
+            name = name.lower().decode('latin-1')
+            value = value.strip().decode('latin-1')
+            # Повторяющиеся заголовки объединяются через запятую
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+        try:
+            method, target, version = (part.decode('ascii') for part in parts)
+        except UnicodeDecodeError:
+            raise HTTPParseError(400, 'Некорректная строка запроса')
+        return HTTPRequest(method, target, version, headers)
+
+    def start_body(self, headers):
+        transfer_encoding = headers.get('transfer-encoding')
+        content_length = headers.get('content-length')
+        if transfer_encoding is not None:
+            # Оба заголовка сразу - классический прием request smuggling (RFC 7230, 3.3.3)
+            if content_length is not None:
+                raise HTTPParseError(400, 'Одновременно заданы Transfer-Encoding и Content-Length')
+            if transfer_encoding.lower() != 'chunked':
+                raise HTTPParseError(501, f'Transfer-Encoding {transfer_encoding} не поддерживается')
+            self.body = bytearray()
+            self.chunk_state = 'size'
+            return
+
+        if content_length is None:
+            return
+        # isdigit() без isascii() пропускает символы вроде '²', на которых падает int()
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise HTTPParseError(400, 'Некорректный Content-Length')
+        self.body_remaining = int(content_length)
+        if self.body_remaining > self.max_body_size:
+            raise HTTPParseError(413, 'Слишком большое тело запроса')
+        self.body = bytearray()
+
+    def take_body_bytes(self, buf):
+        take = min(len(buf), self.body_remaining)
+        if take:
+            self.body += buf[:take]
+            del buf[:take]
+            self.body_remaining -= take
+
+    def read_fixed_body(self, buf):
+        self.take_body_bytes(buf)
+        return self.body_remaining == 0
+
+    def read_chunked_body(self, buf):
+        while True:
+            if self.chunk_state == 'data':
+                self.take_body_bytes(buf)
+                if self.body_remaining:
+                    return False
+                self.chunk_state = 'data_end'
+                continue
+
+            if self.chunk_state == 'data_end':
+                if len(buf) < 2:
+                    return False
+                if buf[:2] != b'\r\n':
+                    raise HTTPParseError(400, 'Некорректный chunk')
+                del buf[:2]
+                self.chunk_state = 'size'
+                continue
+
+            # Строка размера chunk'а или строка трейлера
+            end = buf.find(b'\r\n')
+            if end < 0:
+                if len(buf) > MAX_CHUNK_LINE:
+                    raise HTTPParseError(400, 'Слишком длинная строка chunked-кодирования')
+                return False
+            line = buf[:end]
+            del buf[:end + 2]
+
+            if self.chunk_state == 'trailer':
+                # Пустая строка завершает трейлеры и все тело
+                if not line:
+                    return True
+                continue
+
+            size = line.split(b';', 1)[0].strip()
+            try:
+                size = int(size, 16)
+            except ValueError:
+                raise HTTPParseError(400, 'Некорректный размер chunk')
+            if size == 0:
+                self.chunk_state = 'trailer'
+                continue
+            if len(self.body) + size > self.max_body_size:
+                raise HTTPParseError(413, 'Слишком большое тело запроса')
+            self.body_remaining = size
+            self.chunk_state = 'data'
+
+class ServerStats:
+    """Счетчики сервера: коды ответов, отправленные байты, активные соединения, гистограмма задержек"""
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.status_codes = Counter()
+        self.bytes_sent = 0
+        self.active_connections = 0
+        self.total_connections = 0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_total_ms = 0.0
+
+    def connection_opened(self):
+        with self.lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def record_request(self, status_code, size, latency_ms):
+        bucket = bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+        with self.lock:
+            self.requests += 1
+            self.status_codes[status_code] += 1
+            self.bytes_sent += size
+            self.latency_buckets[bucket] += 1
+            self.latency_total_ms += latency_ms
+
+    def snapshot(self):
+        with self.lock:
+            buckets = list(self.latency_buckets)
+            snapshot = {
+                'pid': os.getpid(),
+                'uptime_s': round(time.time() - self.started, 1),
+                'requests': self.requests,
+                'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+                'bytes_sent': self.bytes_sent,
+                'active_connections': self.active_connections,
+                'total_connections': self.total_connections,
+                'latency_mean_ms': round(self.latency_total_ms / self.requests, 3) if self.requests else 0.0
+            }
+        snapshot['latency_histogram'] = [
+            {'le_ms': bound, 'count': count}
+            for bound, count in zip(LATENCY_BUCKETS_MS + [None], buckets)
+        ]
+        return snapshot
+
+class AccessLog:
+    """Журнал запросов: выборка записей и запись в фоновом потоке, чтобы не тормозить обработку"""
+    def __init__(self, path=None, sample_rate=1.0, queue_size=10000):
+        self.path = path  # None - писать в stdout
+        self.sample_rate = sample_rate  # Доля запросов, попадающих в журнал
+        self.queue_size = queue_size
+        self.queue = None
+        self.writer_pid = None
+        self.writer_lock = Lock()
+        self.dropped = 0  # Записи, отброшенные из-за переполнения очереди
+
+    def log(self, addr, method, target, status_code, size, latency_ms):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        # Поток-писатель не переживает fork, поэтому в каждом воркере запускаем свой
+        if self.writer_pid != os.getpid():
+            self.start_writer()
+        try:
+            self.queue.put_nowait((time.time(), addr, method, target, status_code, size, latency_ms))
+        except queue.Full:
+            with self.writer_lock:
+                self.dropped += 1
+
+    def start_writer(self):
+        # Несколько потоков клиентов могут одновременно заметить отсутствие писателя - запускаем его один раз
+        with self.writer_lock:
+            if self.writer_pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            Thread(target=self.write_loop, args=(self.queue,), daemon=True).start()
+            self.writer_pid = os.getpid()
+
+    def write_loop(self, records):
+        out = open(self.path, 'a', buffering=1) if self.path else sys.stdout
+        while True:
+            timestamp, addr, method, target, status_code, size, latency_ms = records.get()
+            client = f'{addr[0]}:{addr[1]}' if addr else '-'
+            out.write(f'{client} [{formatdate(timestamp, usegmt=True)}] "{method} {target}" '
+                      f'{status_code} {size} {latency_ms:.2f}ms\n')
+
+class Connection:
+    """Состояние клиентского соединения"""
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()  # Переиспользуемый буфер входящих данных
+        self.parser = RequestParser()
+        self.outqueue = deque()  # Части ответов: bytes или FileBody
+        self.sent = 0  # Сколько байт первой части outqueue уже отправлено
+        self.requests_served = 0
+        self.close_after = False  # Закрыть соединение после отправки outqueue
+        self.last_active = time.monotonic()
+        # Текущий запрос для статистики и журнала: метод, цель, код и размер ответа, время начала
+        self.request_line = ('-', '-')
+        self.response_status = 0
+        self.response_size = 0
+        self.request_started = 0.0
+
+    def discard_output(self):
+        for part in self.outqueue:
+            if isinstance(part, FileBody):
+                part.close()
+        self.outqueue.clear()
 
 class HTTPServer:
-    def __init__(self, host='localhost', port=8080):
+    def __init__(self, host='localhost', port=8080, mode='thread', backlog=128, max_connections=1000,
+                 keepalive_timeout=5, max_requests=100, cache=None, workers=1, drain_timeout=10,
+                 stats_path='/__stats', access_log=None):
         self.host = host
         self.port = port
-        
-    def start(self):
+        self.mode = mode  # 'thread' - поток на соединение, 'selector' - один цикл событий
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout  # Сколько секунд держим простаивающее соединение
+        self.max_requests = max_requests  # Максимум запросов на одно соединение
+        self.cache = cache if cache is not None else StaticFileCache()
+        self.workers = workers  # Число процессов-воркеров, 1 - без supervisor'а
+        self.drain_timeout = drain_timeout  # Сколько секунд воркер дорабатывает соединения после SIGTERM
+        self.worker_pids = {}  # pid -> (номер воркера, время запуска)
+        self.stopping = False
+        self.stats_path = stats_path  # Зарезервированный путь со статистикой, None - статистика отключена
+        self.stats = ServerStats() if stats_path else None
+        self.access_log = access_log
+        self.date_second = None
+        self.date_line = b''
+        self.connection_slots = BoundedSemaphore(max_connections)
+        self.selector = None
+        self.server_socket = None
+        self.connections = {}
+        self.client_threads = set()
+        self.accepting = False
+
+    def create_server_socket(self, reuse_port=False):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Каждый воркер слушает свой сокет на том же порту, ядро само распределяет соединения
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((self.host, self.port))
-        server_socket.listen(5)
-        print(f'[*] Сервер запущен на {self.host}:{self.port}')
-        
-        while True:
-            client_socket, addr = server_socket.accept()
-            print(f'[*] Получено соединение от {addr[0]}:{addr[1]}')
-            client_thread = Thread(target=self.handle_client, args=(client_socket,))
+        server_socket.listen(self.backlog)
+        return server_socket
+
+    def start(self):
+        if self.workers > 1:
+            self.run_supervisor()
+            return
+
+        server_socket = self.create_server_socket()
+        print(f'[*] Сервер запущен на {self.host}:{self.port} (режим: {self.mode})')
+
+        try:
+            self.serve(server_socket)
+        except KeyboardInterrupt:
+            print('\n[*] Сервер остановлен')
+        finally:
+            server_socket.close()
+
+    def serve(self, server_socket):
+        self.server_socket = server_socket
+        if self.mode == 'selector':
+            self.serve_selector(server_socket)
+        else:
+            self.serve_threads(server_socket)
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def run_supervisor(self):
+        """Запускает воркеры, перезапускает упавшие и плавно останавливает всех по SIGTERM/SIGINT"""
+        if not hasattr(os, 'fork'):
+            print('[!] Режим нескольких воркеров требует os.fork')
+            return
+
+        # Без SO_REUSEPORT воркеры делят один слушающий сокет, открытый до fork
+        shared_socket = None
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            shared_socket = self.create_server_socket()
+
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        print(f'[*] Сервер запущен на {self.host}:{self.port} (режим: {self.mode}, воркеров: {self.workers})')
+        for worker_id in range(self.workers):
+            self.spawn_worker(worker_id, shared_socket)
+
+        kill_deadline = None
+        while self.worker_pids:
+            if self.stopping and kill_deadline is None:
+                print('[*] Останавливаем воркеры...')
+                kill_deadline = time.monotonic() + self.drain_timeout + 1
+                self.signal_workers(signal.SIGTERM)
+            elif kill_deadline is not None and time.monotonic() > kill_deadline:
+                self.signal_workers(signal.SIGKILL)
+
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+
+            worker_id, started = self.worker_pids.pop(pid)
+            if self.stopping:
+                continue
+            print(f'[!] Воркер {worker_id} (pid {pid}) завершился с кодом {os.waitstatus_to_exitcode(status)}, перезапускаем')
+            # Не перезапускаем в цикле воркер, который падает сразу после старта
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            self.spawn_worker(worker_id, shared_socket)
+
+        if shared_socket:
+            shared_socket.close()
+        print('[*] Сервер остановлен')
+
+    def spawn_worker(self, worker_id, shared_socket):
+        pid = os.fork()
+        if pid:
+            self.worker_pids[pid] = (worker_id, time.monotonic())
+            return
+
+        exit_code = 0
+        try:
+            # Ctrl+C получает вся группа процессов - остановкой воркеров управляет supervisor
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self.request_stop)
+            self.worker_pids = {}
+            server_socket = shared_socket or self.create_server_socket(reuse_port=True)
+            self.serve(server_socket)
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def signal_workers(self, signum):
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def serve_threads(self, server_socket):
+        """Поток на каждое соединение, не более max_connections одновременно"""
+        # Таймауты нужны, чтобы периодически проверять флаг остановки
+        server_socket.settimeout(1.0)
+        while not self.stopping:
+            # Пока все слоты заняты, новые соединения ждут в очереди listen
+            if not self.connection_slots.acquire(timeout=1.0):
+                continue
+            try:
+                client_socket, addr = server_socket.accept()
+            except socket.timeout:
+                self.connection_slots.release()
+                continue
+            client_thread = Thread(target=self.run_client_thread, args=(client_socket, addr), daemon=True)
+            self.client_threads.add(client_thread)
             client_thread.start()
-            
-    def handle_client(self, client_socket):
-        request = client_socket.recv(1024).decode()
-        
+
+        # Остановка: новые соединения не принимаем, ждем завершения текущих
+        server_socket.close()
+        deadline = time.monotonic() + self.drain_timeout
+        for client_thread in list(self.client_threads):
+            client_thread.join(max(0, deadline - time.monotonic()))
+
+    def run_client_thread(self, client_socket, addr):
+        try:
+            self.handle_client(client_socket, addr)
+        finally:
+            self.client_threads.discard(current_thread())
+            self.connection_slots.release()
+
+    def handle_client(self, client_socket, addr=None):
+        conn = Connection(client_socket, addr)
+        if self.stats:
+            self.stats.connection_opened()
+        try:
+            while not conn.close_after and not self.stopping:
+                # Читаем с коротким таймаутом, чтобы простаивающее соединение замечало остановку сервера
+                client_socket.settimeout(min(1.0, self.keepalive_timeout))
+                try:
+                    data = client_socket.recv(RECV_SIZE)
+                except socket.timeout:
+                    if time.monotonic() - conn.last_active > self.keepalive_timeout:
+                        break
+                    continue
+                if not data:
+                    break
+                conn.inbuf += data
+
+                # Отвечаем на все полные запросы в буфере (в том числе конвейерные) по очереди
+                client_socket.settimeout(self.keepalive_timeout)
+                parts = self.next_response(conn)
+                while parts:
+                    self.send_parts(client_socket, parts)
+                    self.finish_request(conn)
+                    parts = self.next_response(conn)
+                conn.last_active = time.monotonic()
+        except socket.timeout:
+            pass  # Клиент не принимал ответ дольше keepalive_timeout
+        except OSError as e:
+            print(f'[!] Ошибка соединения: {e}')
+        finally:
+            client_socket.close()
+            if self.stats:
+                self.stats.connection_closed()
+
+    def send_parts(self, client_socket, parts):
+        try:
+            for part in parts:
+                if isinstance(part, FileBody):
+                    part.send_blocking(client_socket)
+                else:
+                    client_socket.sendall(part)
+        finally:
+            for part in parts:
+                if isinstance(part, FileBody):
+                    part.close()
+
+    def next_response(self, conn):
+        """Извлекает из буфера следующий полный запрос и возвращает части ответа на него"""
+        if conn.close_after:
+            return None
+
+        # Время запроса отсчитывается до разбора, чтобы в задержку попала вся обработка
+        started = time.perf_counter()
+        try:
+            request = conn.parser.parse(conn.inbuf)
+        except HTTPParseError as e:
+            # После ошибки разбора граница следующего запроса неизвестна - закрываем соединение
+            conn.close_after = True
+            conn.request_line = ('-', str(e))
+            parts = [self.create_response(e.status_code)]
+        else:
+            if request is None:
+                return None
+            conn.requests_served += 1
+            conn.request_line = (request.method, request.target)
+
+            keep_alive = (self.wants_keep_alive(request) and conn.requests_served < self.max_requests
+                          and not self.stopping)
+            if not keep_alive:
+                conn.close_after = True
+            parts = self.handle_request(request, keep_alive)
+
+        conn.request_started = started
+        # Строка статуса всегда имеет вид 'HTTP/1.1 NNN ...'
+        conn.response_status = int(parts[0][9:12])
+        conn.response_size = sum(part.remaining if isinstance(part, FileBody) else len(part) for part in parts)
+        return parts
+
+    def finish_request(self, conn):
+        """Учитывает отправленный ответ в статистике и журнале запросов"""
+        if not self.stats and not self.access_log:
+            return
+        latency_ms = (time.perf_counter() - conn.request_started) * 1000
+        if self.stats:
+            self.stats.record_request(conn.response_status, conn.response_size, latency_ms)
+        if self.access_log:
+            method, target = conn.request_line
+            self.access_log.log(conn.addr, method, target, conn.response_status, conn.response_size, latency_ms)
+
+    def wants_keep_alive(self, request):
+        """HTTP/1.1 держит соединение по умолчанию, HTTP/1.0 - только по Connection: keep-alive"""
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+    def handle_request(self, request, keep_alive=False):
+        """Обрабатывает разобранный запрос и возвращает список частей ответа (bytes или FileBody)"""
         try:
-            # Парсим HTTP запрос
-            headers = request.split('\n')
-            filename = headers[0].split()[1]
+            filename = request.target
+            if self.stats and filename == self.stats_path:
+                snapshot = self.stats.snapshot()
+                if self.access_log:
+                    snapshot['access_log_dropped'] = self.access_log.dropped
+                body = json.dumps(snapshot).encode()
+                return [self.create_response(200, body, keep_alive,
+                                             ['Content-Type: application/json', 'Cache-Control: no-store'])]
             if filename == '/':
                 filename = '/index.html'
-                
+
             # Убираем начальный слэш
             filename = filename[1:]
-            
-            # Проверяем существование файла
-            if os.path.exists(filename):
-                with open(filename, 'rb') as f:
-                    content = f.read()
-                response = self.create_response(200, content)
+
+            # Проверяем существование файла (через кэш - один stat на запрос)
+            try:
+                entry = self.cache.get(filename)
+            except (FileNotFoundError, NotADirectoryError):
+                response = self.create_response(404, keep_alive=keep_alive)
             else:
-                response = self.create_response(404)
-                
+                return self.file_response(entry, request.headers, keep_alive)
+
         except Exception as e:
             print(f'[!] Ошибка: {e}')
-            response = self.create_response(500)
-            
-        client_socket.send(response)
-        client_socket.close()
-        
-    def create_response(self, status_code, content=None):
+            response = self.create_response(500, keep_alive=keep_alive)
+
+        return [response]
+
+    def file_response(self, entry, request_headers, keep_alive):
+        """Отвечает файлом целиком (200), его диапазоном (206) или 304, если у клиента актуальная копия"""
+        range_header = request_headers.get('range')
+        # Диапазоны отдаем только из несжатого представления
+        representation = entry.identity
+        if entry.gzip and not range_header and self.accepts_gzip(request_headers):
+            representation = entry.gzip
+
+        if self.not_modified(entry, representation, request_headers):
+            return [self.create_headers(304, 0, keep_alive, representation.entity_headers)]
+
+        size = representation.size
+        if_range = request_headers.get('if-range')
+        # If-Range: диапазон отдаем, только если файл не изменился с момента получения валидатора
+        if range_header and (if_range is None or if_range in (entry.etag, entry.last_modified)):
+            extra_headers = ['Accept-Ranges: bytes'] + representation.entity_headers
+            try:
+                byte_range = self.parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                return [self.create_response(416, keep_alive=keep_alive,
+                                             extra_headers=[f'Content-Range: bytes */{size}'])]
+
+            if byte_range:
+                start, end = byte_range
+                extra_headers.append(f'Content-Range: bytes {start}-{end}/{size}')
+                head = self.create_headers(206, end - start + 1, keep_alive, extra_headers)
+                return self.body_parts(head, representation, start, end - start + 1)
+
+        # Заголовки ответа 200 собираются один раз на версию файла
+        head = representation.headers.get(keep_alive)
+        if head is None:
+            head = self.header_block(200, size, keep_alive, ['Accept-Ranges: bytes'] + representation.entity_headers)
+            representation.headers[keep_alive] = head
+        return self.body_parts(head + self.current_date_line(), representation, 0, size)
+
+    def accepts_gzip(self, request_headers):
+        """Разбирает Accept-Encoding с учетом q-значений"""
+        weights = {}
+        for item in request_headers.get('accept-encoding', '').split(','):
+            name, _, params = item.partition(';')
+            weight = 1.0
+            params = params.strip().lower()
+            if params.startswith('q='):
+                try:
+                    weight = float(params[2:])
+                except ValueError:
+                    weight = 0.0
+            weights[name.strip().lower()] = weight
+        return weights.get('gzip', weights.get('x-gzip', weights.get('*', 0.0))) > 0
+
+    def body_parts(self, head, representation, start, length):
+        if representation.content is None:
+            return [head, FileBody(representation.path, start, length)]
+
+        content = representation.content
+        body = content if length == len(content) else memoryview(content)[start:start + length]
+        # Небольшое тело дешевле отправить одним буфером вместе с заголовками
+        if length <= INLINE_FILE_SIZE:
+            return [head + body]
+        return [head, body]
+
+    def not_modified(self, entry, representation, request_headers):
+        """Проверяет If-None-Match / If-Modified-Since (If-None-Match имеет приоритет)"""
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or representation.etag in tags
+
+        if_modified_since = request_headers.get('if-modified-since')
+        if not if_modified_since:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return entry.mtime <= since
+
+    def parse_range(self, value, size):
+        """Разбирает заголовок Range с одним диапазоном байт и возвращает (start, end) или None, если его нужно игнорировать"""
+        unit, _, spec = value.partition('=')
+        # Несколько диапазонов не поддерживаем - по RFC 7233 можно ответить всем файлом
+        if unit.strip().lower() != 'bytes' or ',' in spec:
+            return None
+
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first == '':
+                # bytes=-N - последние N байт файла
+                suffix = int(last)
+                if suffix <= 0 or size == 0:
+                    raise RangeNotSatisfiable()
+                return max(size - suffix, 0), size - 1
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+
+        if start >= size:
+            raise RangeNotSatisfiable()
+        if end < start:
+            return None
+        return start, min(end, size - 1)
+
+    def serve_selector(self, server_socket):
+        """Мультиплексирует все клиентские сокеты в одном цикле событий"""
+        server_socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(server_socket, selectors.EVENT_READ)
+        self.accepting = True
+        last_sweep = time.monotonic()
+        drain_deadline = None
+
+        while self.connections or not self.stopping:
+            if self.stopping and drain_deadline is None:
+                drain_deadline = time.monotonic() + self.drain_timeout
+                self.begin_drain()
+
+            for key, mask in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    self.accept_connections(key.fileobj)
+                    continue
+
+                conn = key.data
+                try:
+                    if mask & selectors.EVENT_READ:
+                        self.on_readable(conn)
+                    elif mask & selectors.EVENT_WRITE:
+                        self.on_writable(conn)
+                except OSError as e:
+                    print(f'[!] Ошибка соединения: {e}')
+                    self.close_connection(conn)
+                except Exception:
+                    # Ошибка обработки одного клиента не должна останавливать цикл и рвать остальные соединения
+                    traceback.print_exc()
+                    self.close_connection(conn)
+
+            # Раз в секунду закрываем соединения, простаивающие дольше keepalive_timeout
+            now = time.monotonic()
+            if now - last_sweep >= 1.0:
+                last_sweep = now
+                for conn in list(self.connections.values()):
+                    if now - conn.last_active > self.keepalive_timeout:
+                        self.close_connection(conn)
+
+            if drain_deadline is not None and now > drain_deadline:
+                for conn in list(self.connections.values()):
+                    self.close_connection(conn)
+
+    def begin_drain(self):
+        """Перестает принимать соединения: простаивающие закрывает, остальным дает дописать ответ"""
+        self.pause_accepting()
+        self.server_socket.close()
+        for conn in list(self.connections.values()):
+            if conn.outqueue:
+                conn.close_after = True
+            else:
+                self.close_connection(conn)
+
+    def accept_connections(self, server_socket):
+        # Принимаем все ожидающие соединения за одно пробуждение
+        while len(self.connections) < self.max_connections:
+            try:
+                client_socket, addr = server_socket.accept()
+            except BlockingIOError:
+                return
+            client_socket.setblocking(False)
+            conn = Connection(client_socket, addr)
+            self.connections[client_socket.fileno()] = conn
+            if self.stats:
+                self.stats.connection_opened()
+            self.selector.register(client_socket, selectors.EVENT_READ, conn)
+
+        # Достигнут лимит: перестаем принимать, остальные ждут в очереди listen
+        self.pause_accepting()
+
+    def pause_accepting(self):
+        if self.accepting:
+            self.selector.unregister(self.server_socket)
+            self.accepting = False
+
+    def resume_accepting(self):
+        if not self.accepting and not self.stopping and len(self.connections) < self.max_connections:
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
+            self.accepting = True
+
+    def on_readable(self, conn):
+        data = conn.sock.recv(RECV_SIZE)
+        if not data:
+            self.close_connection(conn)
+            return
+
+        conn.last_active = time.monotonic()
+        conn.inbuf += data
+        parts = self.next_response(conn)
+        if not parts:
+            return
+
+        # Пока ответ не отправлен, новые запросы не читаем - в памяти не больше одного ответа
+        conn.outqueue.extend(parts)
+        conn.sent = 0
+        self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+
+    def on_writable(self, conn):
+        part = conn.outqueue[0]
+        try:
+            if isinstance(part, FileBody):
+                part.send_chunk(conn.sock)
+                done = part.remaining == 0
+            else:
+                conn.sent += conn.sock.send(memoryview(part)[conn.sent:])
+                done = conn.sent >= len(part)
+        except BlockingIOError:
+            return
+        conn.last_active = time.monotonic()
+        if not done:
+            return
+
+        conn.outqueue.popleft()
+        conn.sent = 0
+        if isinstance(part, FileBody):
+            part.close()
+        if conn.outqueue:
+            return
+
+        # Ответ отправлен - берем следующий конвейерный запрос из буфера
+        self.finish_request(conn)
+        parts = self.next_response(conn)
+        if parts:
+            conn.outqueue.extend(parts)
+        elif conn.close_after:
+            self.close_connection(conn)
+        else:
+            self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def close_connection(self, conn):
+        if self.connections.pop(conn.sock.fileno(), None) is None:
+            return
+        self.selector.unregister(conn.sock)
+        conn.discard_output()
+        conn.sock.close()
+        if self.stats:
+            self.stats.connection_closed()
+        self.resume_accepting()
+
+    def current_date_line(self):
+        """Строка Date, завершающая заголовки; пересчитывается не чаще раза в секунду"""
+        now = int(time.time())
+        if now != self.date_second:
+            self.date_line = f'Date: {formatdate(now, usegmt=True)}\r\n\r\n'.encode()
+            self.date_second = now
+        return self.date_line
+
+    def create_headers(self, status_code, content_length, keep_alive=False, extra_headers=()):
+        return self.header_block(status_code, content_length, keep_alive, extra_headers) + self.current_date_line()
+
+    def header_block(self, status_code, content_length, keep_alive=False, extra_headers=()):
+        """Все заголовки ответа, кроме Date, который добавляется последним"""
         status_messages = {
             200: 'OK',
+            206: 'Partial Content',
+            304: 'Not Modified',
+            400: 'Bad Request',
             404: 'Not Found',
-            500: 'Internal Server Error'
+            413: 'Content Too Large',
+            416: 'Range Not Satisfiable',
+            431: 'Request Header Fields Too Large',
+            500: 'Internal Server Error',
+            501: 'Not Implemented'
         }
-        
+
         # Формируем заголовки
         headers = [
             f'HTTP/1.1 {status_code} {status_messages[status_code]}',
-            f'Date: {datetime.now().strftime("%a, %d %b %Y %H:%M:%S GMT")}',
-            'Server: Python HTTP Server',
-            'Connection: close'
+            'Server: Python HTTP Server'
         ]
-        
-        if content:
+
+        if keep_alive:
             headers.extend([
-                f'Content-Length: {len(content)}',
-                'Content-Type: text/html; charset=utf-8'
+                'Connection: keep-alive',
+                f'Keep-Alive: timeout={self.keepalive_timeout}, max={self.max_requests}'
             ])
-            response = '\r\n'.join(headers).encode() + b'\r\n\r\n' + content
         else:
-            response = '\r\n'.join(headers).encode() + b'\r\n\r\n'
-            
+            headers.append('Connection: close')
+
+        # Content-Length нужен всегда, иначе клиент не найдет конец ответа в постоянном соединении
+        # (кроме 304 - там он описывал бы не отправленное тело)
+        if status_code != 304:
+            headers.append(f'Content-Length: {content_length}')
+        headers.extend(extra_headers)
+
+        return ''.join(f'{header}\r\n' for header in headers).encode()
+
+    def create_response(self, status_code, content=None, keep_alive=False, extra_headers=()):
+        response = self.create_headers(status_code, len(content) if content else 0, keep_alive, extra_headers)
+        if content:
+            response += content
         return response
 
 if __name__ == '__main__':
-    server = HTTPServer()
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Простой HTTP сервер')
+    parser.add_argument('--host', default='localhost', help='Адрес для прослушивания')
+    parser.add_argument('--port', type=int, default=8080, help='Порт сервера')
+    parser.add_argument('--mode', choices=['thread', 'selector'], default='thread',
+                        help='Модель обработки соединений')
+    parser.add_argument('--backlog', type=int, default=128, help='Размер очереди listen')
+    parser.add_argument('--max-connections', type=int, default=1000,
+                        help='Максимум одновременных соединений')
+    parser.add_argument('--keepalive-timeout', type=float, default=5,
+                        help='Таймаут простоя постоянного соединения, сек')
+    parser.add_argument('--max-requests', type=int, default=100,
+                        help='Максимум запросов на одно соединение')
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='Объем кэша содержимого файлов, МБ')
+    parser.add_argument('--cache-max-file', type=int, default=1024,
+                        help='Файлы крупнее этого (КБ) не кэшируются и отправляются через sendfile')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Число процессов-воркеров на одном порту (SO_REUSEPORT)')
+    parser.add_argument('--drain-timeout', type=float, default=10,
+                        help='Сколько секунд воркер дорабатывает соединения после SIGTERM')
+    parser.add_argument('--stats-path', default='/__stats', help='Путь, по которому отдается статистика в JSON')
+    parser.add_argument('--no-stats', action='store_true', help='Не собирать статистику')
+    parser.add_argument('--access-log', help='Файл журнала запросов (по умолчанию stdout)')
+    parser.add_argument('--access-log-sample', type=float, default=1.0,
+                        help='Доля запросов, попадающих в журнал (0 - журнал отключен)')
+    args = parser.parse_args()
+
+    cache = StaticFileCache(args.cache_size * 1024 * 1024, args.cache_max_file * 1024)
+    access_log = AccessLog(args.access_log, args.access_log_sample) if args.access_log_sample > 0 else None
+    server = HTTPServer(args.host, args.port, args.mode, args.backlog, args.max_connections,
+                        args.keepalive_timeout, args.max_requests, cache, args.workers, args.drain_timeout,
+                        None if args.no_stats else args.stats_path, access_log)
+    server.start()
@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import importlib.util
+
+# heart-server.py нельзя импортировать обычным import из-за дефиса в имени
+spec = importlib.util.spec_from_file_location('heart_server', os.path.join(os.path.dirname(__file__), 'heart-server.py'))
+heart_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(heart_server)
+
+
+def make_heartbeat(sequence, binary=True):
+  if binary:
+    return heart_server.HEARTBEAT.pack(heart_server.HEARTBEAT_MAGIC, heart_server.HEARTBEAT_VERSION,
+                                       sequence, time.time())
+  return json.dumps({'sequence': sequence, 'timestamp': time.time()}).encode()
+
+def client_addresses(clients):
+  """Уникальные адреса клиентов 10.x.y.z:12000 (до 16 млн клиентов)"""
+  return [(f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', 12000) for i in range(clients)]
+
+def populate(server, clients, interval, start):
+  """Регистрирует клиентов так, чтобы их heartbeat'ы были равномерно распределены по интервалу"""
+  for i, address in enumerate(client_addresses(clients)):
+    server.handle_heartbeat(make_heartbeat(1), address, time.time(), start - interval + interval * i / clients)
+
+def bench_expiry(clients, packets, interval, timeout, check_interval, silent):
+  """
+  Каждый клиент шлет heartbeat раз в interval секунд модельного времени, доля silent клиентов молчит.
+  Проверка таймаутов вызывается по таймеру check_interval, как в цикле сервера.
+  Замер должен охватывать несколько интервалов, иначе сроки в куче не успеют наступить
+  :return: среднее время обработки одного heartbeat вместе с долей проверок таймаутов, мкс
+  """
+  server = heart_server.HeartbeatServer(0, timeout, check_interval)
+  now = 0.0
+  populate(server, clients, interval, now)
+  step = interval / clients  # Модельное время между пакетами при равномерной нагрузке
+  payloads = [make_heartbeat(seq) for seq in range(2, 12)]
+  silent_every = int(1 / silent) if silent else 0
+  addresses = client_addresses(clients)
+
+  last_check = now
+  started = time.perf_counter()
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    for i in range(packets):
+      now += step
+      client = i % clients
+      if silent_every and client % silent_every == 0:
+        continue
+      server.handle_heartbeat(payloads[i // clients % 10], addresses[client], 0.0, now)
+      if now - last_check >= check_interval:
+        server.check_timeouts(now)
+        last_check = now
+  return (time.perf_counter() - started) / packets * 1e6
+
+def bench_full_scan(clients, packets, timeout):
+  """Прежний алгоритм: полный обход всех клиентов после каждого пакета"""
+  server = heart_server.HeartbeatServer(0, timeout)
+  populate(server, clients, 1.0, 0.0)
+  payload = make_heartbeat(2)
+  addresses = client_addresses(clients)
+  started = time.perf_counter()
+  for i in range(packets):
+    server.handle_heartbeat(payload, addresses[i % clients], 0.0, 0.0)
+    for addr, client in list(server.clients.items()):
+      if 0.0 - client.last_seen > timeout:
+        del server.clients[addr]
+  return (time.perf_counter() - started) / packets * 1e6
+
+def bench_memory(clients):
+  """
+  Память на хранение клиентов: прежний словарь словарей, записи ClientState и весь сервер (с кучей сроков)
+  :return: байт на клиента для каждого варианта
+  """
+  def measure(build):
+    before = tracemalloc.get_traced_memory()[0]
+    table = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    del table
+    return size / clients
+
+  def build_dicts():
+    return {address: {'last_sequence': 1, 'last_seen': float(i), 'packets_received': 1,
+                              'min_rtt': 0.5, 'max_rtt': 0.5, 'total_rtt': 0.5}
+            for i, address in enumerate(addresses)}
+
+  def build_slots():
+    return {address: heart_server.ClientState(1, float(i), 0.5) for i, address in enumerate(addresses)}
+
+  def build_server():
+    server = heart_server.HeartbeatServer(0, 10)
+    populate(server, clients, 1.0, 0.0)
+    return server
+
+  # Адреса создаются заранее, чтобы в замер попадала только таблица клиентов
+  addresses = client_addresses(clients)
+  tracemalloc.start()
+  result = measure(build_dicts), measure(build_slots), measure(build_server)
+  tracemalloc.stop()
+  return result
+
+def bench_parse(packets):
+  """Время разбора одного heartbeat в JSON и в бинарном формате, мкс"""
+  result = []
+  for binary in (False, True):
+    payload = bytearray(make_heartbeat(12345, binary))
+    started = time.perf_counter()
+    for _ in range(packets):
+      heart_server.parse_heartbeat(payload)
+    result.append((time.perf_counter() - started) / packets * 1e6)
+  return result
+
+def bench_snapshot(clients):
+  """
+  Запись и загрузка снимка таблицы клиентов
+  :return: (время записи до замены файла, самый долгий шаг цикла событий, размер файла, время загрузки)
+  """
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'clients.snap')
+    server = heart_server.HeartbeatServer(0, 3600, snapshot_path=path)
+    populate(server, clients, 1.0, time.monotonic())
+
+    # Каждый шаг генератора замеряется отдельно, включая последний (завершающийся StopIteration)
+    longest = 0.0
+    job = server.write_snapshot()
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      while True:
+        step_started = time.perf_counter()
+        try:
+          next(job)
+        except StopIteration:
+          break
+        finally:
+          longest = max(longest, time.perf_counter() - step_started)
+      # Файл дописывает, синхронизирует и подменяет поток записи - ждем его, но в паузы цикла это не входит
+      server.wait_snapshot()
+    written = time.perf_counter() - started
+    size = os.path.getsize(path)
+    del server
+
+    restored = heart_server.HeartbeatServer(0, 3600, snapshot_path=path)
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      restored.load_snapshot()
+    loaded = time.perf_counter() - started
+    assert len(restored.clients) == clients
+  return written, longest, size, loaded
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Бенчмарк проверки таймаутов heartbeat-сервера')
+  parser.add_argument('--mode', choices=['expiry', 'memory', 'snapshot'], default='expiry',
+                      help='expiry - стоимость пакета в зависимости от числа клиентов, '
+                           'memory - память на 100 тыс. клиентов и скорость разбора форматов, '
+                           'snapshot - запись и загрузка снимка')
+  parser.add_argument('--clients', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                      help='Число отслеживаемых клиентов')
+  parser.add_argument('--rounds', type=int, default=4,
+                      help='Сколько раз каждый клиент присылает heartbeat за замер')
+  parser.add_argument('--interval', type=float, default=1.0, help='Интервал heartbeat клиента, сек модельного времени')
+  parser.add_argument('--timeout', type=float, default=2.5, help='Таймаут клиента, сек')
+  parser.add_argument('--check-interval', type=float, default=0.1, help='Интервал проверки таймаутов, сек')
+  parser.add_argument('--silent', type=float, default=0.01, help='Доля клиентов, которые перестают слать heartbeat')
+  parser.add_argument('--scan-packets', type=int, default=10,
+                      help='Число пакетов для замера прежнего полного обхода (0 - не замерять)')
+  args = parser.parse_args()
+
+  if args.mode == 'memory':
+    print('Память на 100 тыс. клиентов:')
+    for name, size in zip(('словарь словарей', 'ClientState', 'сервер целиком (с кучей сроков)'), bench_memory(100000)):
+      print(f'  {name:<32} {size * 100000 / 1e6:6.1f} МБ ({size:.0f} байт/клиент)')
+    json_cost, binary_cost = bench_parse(200000)
+    print(f'Разбор heartbeat: JSON {json_cost:.2f} мкс, бинарный {binary_cost:.2f} мкс')
+    sys.exit(0)
+
+  if args.mode == 'snapshot':
+    print(f'{"Клиентов":>10}{"запись, с":>12}{"макс. шаг цикла, мс":>21}{"размер, МБ":>12}{"загрузка, с":>13}')
+    for clients in args.clients:
+      written, longest, size, loaded = bench_snapshot(clients)
+      print(f'{clients:>10}{written:>12.2f}{longest * 1000:>21.2f}{size / 1e6:>12.1f}{loaded:>13.2f}')
+      sys.stdout.flush()
+    sys.exit(0)
+
+  print(f'{"Клиентов":>10}{"куча, мкс/пакет":>18}{"полный обход, мкс/пакет":>26}')
+  for clients in args.clients:
+    # Для малого числа клиентов берем больше кругов, чтобы замер не был слишком коротким
+    packets = max(clients * args.rounds, 200000)
+    heap_cost = bench_expiry(clients, packets, args.interval, args.timeout, args.check_interval, args.silent)
+    scan_cost = f'{bench_full_scan(clients, args.scan_packets, args.timeout):.2f}' if args.scan_packets else '-'
+    print(f'{clients:>10}{heap_cost:>18.2f}{scan_cost:>26}')
+    sys.stdout.flush()
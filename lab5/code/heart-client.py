@@ -2,13 +2,28 @@ import socket
 import sys
 import time
 import json
+import heapq
+import random
+import struct
+import argparse
+
+# Бинарный формат heartbeat: сигнатура, версия, резерв, номер пакета, время отправки (unix time)
+HEARTBEAT = struct.Struct('!2sBxId')
+HEARTBEAT_MAGIC = b'HB'
+HEARTBEAT_VERSION = 1
 
 class HeartbeatClient:
-    def __init__(self, host, port, interval=1):
+    def __init__(self, host, port, interval=1, binary=True):
         self.host = host
         self.port = port
         self.interval = interval  # Интервал между heartbeat'ами в секундах
+        self.binary = binary  # Бинарный формат вместо JSON
         self.sequence = 0
+
+    def encode(self, timestamp):
+        if self.binary:
+            return HEARTBEAT.pack(HEARTBEAT_MAGIC, HEARTBEAT_VERSION, self.sequence, timestamp)
+        return json.dumps({'sequence': self.sequence, 'timestamp': timestamp}).encode()
         
     def start(self):
         # Создаем UDP сокет
@@ -23,14 +38,11 @@ class HeartbeatClient:
                 self.sequence += 1
                 
                 # Формируем heartbeat пакет
-                heartbeat = {
-                    'sequence': self.sequence,
-                    'timestamp': time.time()
-                }
+                heartbeat = self.encode(time.time())
                 
                 # Отправляем пакет
                 try:
-                    client_socket.sendto(json.dumps(heartbeat).encode(), (self.host, self.port))
+                    client_socket.sendto(heartbeat, (self.host, self.port))
                     print(f'Отправлен heartbeat #{self.sequence}')
                     
                 except Exception as e:
@@ -44,13 +56,137 @@ class HeartbeatClient:
             client_socket.close()
             sys.exit(0)
 
+class VirtualClient:
+    """Виртуальный клиент роя: свой сокет (а значит, свой порт источника) и свой номер последовательности"""
+    __slots__ = ('sock', 'sequence')
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sequence = 0
+
+class HeartbeatSwarm:
+    """
+    Имитация парка из многих клиентов в одном процессе для нагрузочного тестирования сервера.
+    Моменты отправки всех клиентов хранятся в куче, поэтому процессу не нужен поток или sleep на клиента
+    """
+    def __init__(self, host, port, clients, interval=1, jitter=0.0, loss=0.0, churn=0.0, binary=True):
+        self.address = (socket.gethostbyname(host), port)
+        self.clients = clients
+        self.interval = interval
+        self.jitter = jitter  # Случайное отклонение интервала, доля от интервала
+        self.loss = loss  # Доля heartbeat, которые "теряются" и не отправляются
+        self.churn = churn  # Доля клиентов, заменяемых новыми за один интервал
+        self.binary = binary
+
+        self.sent = 0
+        self.dropped = 0
+        self.replaced = 0
+        self.errors = 0
+        self.max_lag = 0.0  # Насколько симулятор отстает от расписания
+
+    def encode(self, client, timestamp):
+        if self.binary:
+            return HEARTBEAT.pack(HEARTBEAT_MAGIC, HEARTBEAT_VERSION, client.sequence, timestamp)
+        return json.dumps({'sequence': client.sequence, 'timestamp': timestamp}).encode()
+
+    def start(self, duration=None):
+        raise_fd_limit(self.clients + 64)
+        virtual = [VirtualClient() for _ in range(self.clients)]
+        # Первые heartbeat равномерно распределяем по интервалу, чтобы не было залпа в начале
+        started = time.monotonic()
+        schedule = [(started + self.interval * i / self.clients, i) for i in range(self.clients)]
+        heapq.heapify(schedule)
+        deadline = started + duration if duration else None
+
+        print(f'Рой из {self.clients} клиентов шлет heartbeat на {self.address[0]}:{self.address[1]} '
+              f'каждые {self.interval} сек (джиттер {self.jitter:.0%}, потери {self.loss:.0%}, '
+              f'смена клиентов {self.churn:.0%} за интервал)')
+        report_at = started + 1
+        last_sent = 0
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                due, index = schedule[0]
+                now = time.monotonic()
+                if now >= report_at:
+                    self.report(now - report_at + 1, self.sent - last_sent)
+                    last_sent = self.sent
+                    report_at = now + 1
+                if due > now:
+                    time.sleep(min(due, report_at) - now)
+                    continue
+                self.max_lag = max(self.max_lag, now - due)
+
+                client = virtual[index]
+                if self.churn and random.random() < self.churn:
+                    # Клиент уходит, на его место приходит новый с другим портом
+                    client.sock.close()
+                    client = virtual[index] = VirtualClient()
+                    self.replaced += 1
+
+                client.sequence += 1
+                if self.loss and random.random() < self.loss:
+                    self.dropped += 1
+                else:
+                    try:
+                        client.sock.sendto(self.encode(client, time.time()), self.address)
+                        self.sent += 1
+                    except OSError:
+                        self.errors += 1
+
+                spread = self.interval * self.jitter
+                next_due = due + self.interval + (random.uniform(-spread, spread) if spread else 0)
+                heapq.heapreplace(schedule, (max(next_due, now), index))
+
+        except KeyboardInterrupt:
+            print("\nРой остановлен")
+
+        finally:
+            for client in virtual:
+                client.sock.close()
+        elapsed = time.monotonic() - started
+        print(f'Итого: отправлено {self.sent} ({self.sent / elapsed:.0f}/с), потеряно намеренно {self.dropped}, '
+              f'заменено клиентов {self.replaced}, ошибок {self.errors}, '
+              f'максимальное отставание от расписания {self.max_lag * 1000:.1f} мс')
+
+    def report(self, elapsed, sent):
+        print(f'[*] {sent / elapsed:.0f} heartbeat/с, всего {self.sent}, потеряно намеренно {self.dropped}, '
+              f'заменено клиентов {self.replaced}, ошибок {self.errors}, '
+              f'отставание до {self.max_lag * 1000:.1f} мс', flush=True)
+        self.max_lag = 0.0
+
+def raise_fd_limit(needed):
+    """Каждому виртуальному клиенту нужен свой сокет - поднимаем мягкий лимит дескрипторов до жесткого"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            print(f'[!] Лимит открытых файлов {hard} меньше числа клиентов, часть сокетов не откроется')
+
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print('Использование: python udp_heartbeat_client.py хост порт')
-        sys.exit(1)
-        
-    host = sys.argv[1]
-    port = int(sys.argv[2])
-    
-    client = HeartbeatClient(host, port)
-    client.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='UDP Heartbeat клиент')
+    parser.add_argument('host', help='Хост сервера')
+    parser.add_argument('port', type=int, help='Порт сервера')
+    parser.add_argument('-i', '--interval', type=float, default=1, help='Интервал между heartbeat, сек')
+    parser.add_argument('--json', action='store_true', help='Отправлять heartbeat в старом формате JSON')
+    parser.add_argument('-n', '--clients', type=int,
+                        help='Режим роя: число виртуальных клиентов, каждый со своим портом источника')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Рой: случайное отклонение интервала (0.1 = ±10%%)')
+    parser.add_argument('--loss', type=float, default=0.0, help='Рой: доля heartbeat, которые не отправляются')
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help='Рой: доля клиентов, которые за интервал уходят и заменяются новыми')
+    parser.add_argument('-d', '--duration', type=float, help='Рой: длительность работы, сек')
+    args = parser.parse_args()
+
+    if args.clients:
+        swarm = HeartbeatSwarm(args.host, args.port, args.clients, args.interval, args.jitter, args.loss,
+                               args.churn, not args.json)
+        swarm.start(args.duration)
+    else:
+        client = HeartbeatClient(args.host, args.port, args.interval, not args.json)
+        client.start()
\ No newline at end of file
@@ -1,99 +1,719 @@
+import os
+import gc
 import socket
 import sys
 import time
 import json
+import math
+import heapq
+import itertools
+import struct
+import signal
+import queue
+import threading
+import argparse
+import selectors
+from array import array
 from datetime import datetime
 
+RECV_SIZE = 1024
+MAX_BATCH = 4096  # Сколько датаграмм разбираем за одно пробуждение, чтобы не задерживать проверку таймаутов
+
+# Бинарный формат heartbeat: сигнатура, версия, резерв, номер пакета, время отправки (unix time)
+HEARTBEAT = struct.Struct('!2sBxId')
+HEARTBEAT_MAGIC = b'HB'
+HEARTBEAT_VERSION = 1
+
+SNAPSHOT_CHUNK = 1000  # Клиентов в одной порции ответа управляющего сокета или файла снимка
+SNAPSHOT_QUEUE = 64  # Порций снимка в очереди к потоку записи (~5 МБ)
+CONTROL_BUFFER = 256 * 1024  # Пока в буфере ответа больше этого, новые порции не готовим
+
+# Файл снимка: заголовок, гистограмма по всем клиентам, затем записи клиентов.
+# Заголовок: сигнатура, версия, порядок байт счетчиков гистограмм (0 - little, 1 - big), время снимка,
+# пакетов получено, клиентов отключено, некорректных пакетов, число клиентов, гистограмма (base, длина)
+SNAPSHOT_HEADER = struct.Struct('!4sBBxxdQQQIHH')
+SNAPSHOT_MAGIC = b'HBSN'
+SNAPSHOT_VERSION = 1
+# Запись клиента: IPv4, порт, номера первого/последнего пакета, получено, не по порядку,
+# RTT min/max/сумма/последний, джиттер, время последнего heartbeat (unix time), гистограмма (base, длина)
+SNAPSHOT_RECORD = struct.Struct('!4sHIIIIddddddHH')
+
+
+def parse_heartbeat(data):
+  """
+  Разбирает heartbeat в бинарном формате или, для совместимости со старыми клиентами, в JSON
+  :return: (номер пакета, время отправки)
+  :raises ValueError: если данные не являются heartbeat
+  """
+  if data[:2] == HEARTBEAT_MAGIC:
+    if len(data) != HEARTBEAT.size:
+      raise ValueError('неверный размер пакета')
+    _, version, sequence, timestamp = HEARTBEAT.unpack(data)
+    if version != HEARTBEAT_VERSION:
+      raise ValueError(f'неподдерживаемая версия {version}')
+    if not math.isfinite(timestamp):
+      raise ValueError('некорректное время отправки')
+    return sequence, timestamp
+
+  # Heartbeat в JSON - всегда объект; глубоко вложенные массивы вызвали бы RecursionError в json.loads
+  if data[:1] != b'{':
+    raise ValueError('некорректный JSON: ожидался объект')
+  try:
+    heartbeat_data = json.loads(data)
+    sequence, timestamp = heartbeat_data['sequence'], float(heartbeat_data['timestamp'])
+  except (KeyError, TypeError, RecursionError) as e:
+    raise ValueError(f'некорректный JSON: {e}')
+  # Номер пакета должен помещаться в поле бинарного формата (и в запись снимка); bool - подкласс int
+  if not isinstance(sequence, int) or isinstance(sequence, bool) or not 0 <= sequence <= 0xFFFFFFFF:
+    raise ValueError('некорректный номер пакета')
+  # json.loads принимает NaN и Infinity
+  if not math.isfinite(timestamp):
+    raise ValueError('некорректное время отправки')
+  return sequence, timestamp
+
+
+class LatencyHistogram:
+  """
+  Логарифмическая гистограмма задержек в стиле HDR: значения в микросекундах делятся на октавы,
+  каждая октава - на 2**SUB_BITS корзин, поэтому погрешность перцентиля не больше ~3%.
+  Массив счетчиков покрывает только диапазон от самой маленькой до самой большой встреченной корзины
+  (не больше ~500 элементов)
+  """
+  SUB_BITS = 4
+  SUB = 1 << SUB_BITS
+  MAX_VALUE = (1 << 31) - 1  # ~36 минут в микросекундах
+
+  __slots__ = ('base', 'counts', 'total')
+
+  def __init__(self):
+    self.base = 0  # Номер корзины, соответствующей counts[0]
+    self.counts = array('I')
+    self.total = 0
+
+  def record(self, ms):
+    if not math.isfinite(ms):
+      # NaN учитываем как 0, бесконечности - как границы диапазона
+      ms = self.MAX_VALUE / 1000 if ms > 0 else 0.0
+    value = min(max(int(ms * 1000), 0), self.MAX_VALUE)
+    shift = max(0, value.bit_length() - self.SUB_BITS - 1)
+    index = shift * self.SUB + (value >> shift)
+    if not self.counts:
+      self.base = index
+    elif index < self.base:
+      self.counts[0:0] = array('I', [0] * (self.base - index))
+      self.base = index
+    offset = index - self.base
+    if offset >= len(self.counts):
+      self.counts.extend([0] * (offset + 1 - len(self.counts)))
+    self.counts[offset] += 1
+    self.total += 1
+
+  def bucket_value(self, index):
+    """Середина корзины, мс"""
+    shift = max(0, index // self.SUB - 1)
+    mantissa = index - shift * self.SUB
+    return ((mantissa << shift) + ((1 << shift) - 1) / 2) / 1000
+
+  def percentile(self, p):
+    if not self.total:
+      return 0.0
+    rank = max(1, math.ceil(p / 100 * self.total))
+    seen = 0
+    for offset, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank:
+        return self.bucket_value(self.base + offset)
+    return self.bucket_value(self.base + len(self.counts) - 1)
+
+  def percentiles(self):
+    return {'p50': self.percentile(50), 'p99': self.percentile(99), 'p999': self.percentile(99.9)}
+
+  @classmethod
+  def restore(cls, base, counts):
+    histogram = cls.__new__(cls)
+    histogram.base = base
+    histogram.counts = counts
+    histogram.total = sum(counts)
+    return histogram
+
+
+class ClientState:
+  """Состояние клиента; __slots__ вместо словаря экономит память при большом числе клиентов"""
+  __slots__ = ('first_sequence', 'last_sequence', 'last_seen', 'packets_received', 'reordered',
+               'min_rtt', 'max_rtt', 'total_rtt', 'last_rtt', 'jitter', 'histogram')
+
+  def __init__(self, sequence, now, rtt):
+    self.first_sequence = sequence
+    self.last_sequence = sequence
+    self.last_seen = now
+    self.packets_received = 1
+    self.reordered = 0  # Пакеты, пришедшие после пакета с большим номером
+    self.min_rtt = rtt
+    self.max_rtt = rtt
+    self.total_rtt = rtt
+    self.last_rtt = rtt
+    self.jitter = 0.0
+    self.histogram = LatencyHistogram()
+    self.histogram.record(rtt)
+
+  def record(self, sequence, now, rtt):
+    """Учитывает очередной heartbeat; возвращает число пакетов, пропущенных перед ним"""
+    gap = sequence - self.last_sequence - 1
+    if sequence > self.last_sequence:
+      self.last_sequence = sequence
+    else:
+      gap = 0
+      self.reordered += 1
+
+    # Джиттер по RFC 3550: сглаженное изменение задержки между соседними пакетами
+    self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+    self.last_rtt = rtt
+    self.last_seen = now
+    self.packets_received += 1
+    self.min_rtt = min(self.min_rtt, rtt)
+    self.max_rtt = max(self.max_rtt, rtt)
+    self.total_rtt += rtt
+    self.histogram.record(rtt)
+    return gap
+
+  @property
+  def lost(self):
+    # Как в RFC 3550: ожидалось пакетов от первого до последнего номера, минус полученные
+    return max(0, self.last_sequence - self.first_sequence + 1 - self.packets_received)
+
+  def pack(self, addr, last_seen):
+    """Запись для файла снимка; last_seen передается в unix time, так как monotonic не переживает перезапуск"""
+    histogram = self.histogram
+    return SNAPSHOT_RECORD.pack(socket.inet_aton(addr[0]), addr[1], self.first_sequence, self.last_sequence,
+                                self.packets_received, self.reordered, self.min_rtt, self.max_rtt, self.total_rtt,
+                                self.last_rtt, self.jitter, last_seen, histogram.base,
+                                len(histogram.counts)) + histogram.counts.tobytes()
+
+  @classmethod
+  def unpack(cls, fields, counts):
+    """Восстанавливает клиента из полей записи снимка; возвращает (адрес, клиент, время последнего heartbeat)"""
+    (ip, port, first_sequence, last_sequence, packets_received, reordered, min_rtt, max_rtt, total_rtt,
+     last_rtt, jitter, last_seen, base, _) = fields
+    client = cls.__new__(cls)
+    client.first_sequence = first_sequence
+    client.last_sequence = last_sequence
+    client.packets_received = packets_received
+    client.reordered = reordered
+    client.min_rtt = min_rtt
+    client.max_rtt = max_rtt
+    client.total_rtt = total_rtt
+    client.last_rtt = last_rtt
+    client.jitter = jitter
+    client.histogram = LatencyHistogram.restore(base, counts)
+    return (socket.inet_ntoa(ip), port), client, last_seen
+
+  def summary(self):
+    return dict(packets_received=self.packets_received, lost=self.lost, reordered=self.reordered,
+                min_rtt=self.min_rtt, avg_rtt=self.total_rtt / self.packets_received, max_rtt=self.max_rtt,
+                jitter=self.jitter, **self.histogram.percentiles())
+
+
+class ControlConnection:
+  """Соединение с управляющим сокетом: запрос читается целиком, ответ отдается порциями"""
+  def __init__(self, sock):
+    self.sock = sock
+    self.inbuf = bytearray()
+    self.outbuf = bytearray()
+    self.chunks = None  # Генератор порций ответа
+
 
 class HeartbeatServer:
-  def __init__(self, port, timeout=10):
+  def __init__(self, port, timeout=10, check_interval=None, log_sample=0.0, control_port=None,
+               control_path=None, snapshot_path=None, snapshot_interval=10):
     self.port = port
     self.timeout = timeout  # Таймаут в секундах
+    # Минимальный интервал между проверками таймаутов: клиенты, истекающие почти одновременно, обрабатываются вместе
+    self.check_interval = check_interval or min(1.0, timeout / 10)
+    # Печатается каждый log_every-й heartbeat и каждое log_every-е сообщение о потерях (0 - не печатать)
+    self.log_every = round(1 / log_sample) if log_sample > 0 else 0
+    self.log_counter = 0
+    self.control_port = control_port  # TCP-порт управляющего сокета на localhost
+    self.control_path = control_path  # Или путь Unix-сокета
+    self.control = {}  # Открытые соединения управляющего сокета
+    self.snapshot_path = snapshot_path  # Файл, куда периодически сохраняется таблица клиентов
+    self.snapshot_interval = snapshot_interval
+    self.snapshot_job = None  # Генератор, упаковывающий текущий снимок порциями
+    self.snapshot_thread = None  # Поток, записывающий снимок в файл
+    self.invalid_packets = 0
     self.clients = {}  # Словарь для хранения информации о клиентах
+    # Куча (срок истечения, адрес) - ровно одна запись на клиента.
+    # Heartbeat только обновляет last_seen, а устаревший срок пересчитывается, когда запись доходит до вершины
+    self.expiry = []
+    self.buffer = bytearray(RECV_SIZE)
+    # Общая гистограмма и счетчики по всем клиентам, включая уже отключившихся
+    self.fleet = LatencyHistogram()
+    self.packets_received = 0
+    self.clients_expired = 0
 
   def start(self):
     # Создаем UDP сокет
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     server_socket.bind(('', self.port))
+    server_socket.setblocking(False)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server_socket, selectors.EVENT_READ)
 
     print(f'UDP Heartbeat сервер запущен на порту {self.port}')
     print(f'Таймаут для клиентов: {self.timeout} секунд')
+    control_socket = self.open_control()
+    if control_socket:
+      selector.register(control_socket, selectors.EVENT_READ, self.accept_control)
+    if hasattr(signal, 'SIGUSR1'):
+      # Сводку можно запросить на ходу: kill -USR1 <pid>
+      signal.signal(signal.SIGUSR1, lambda signum, frame: self.print_fleet())
+
+    if self.snapshot_path:
+      self.load_snapshot()
+      signal.signal(signal.SIGTERM, self.handle_sigterm)
 
+    last_check = time.monotonic()
+    next_snapshot = last_check + self.snapshot_interval
     try:
       while True:
-        # Получаем данные и адрес клиента
-        try:
-          data, client_address = server_socket.recvfrom(1024)
-          current_time = time.time()
+        # Спим до прихода пакетов или до ближайшего истечения клиента (если клиентов нет - без таймаута)
+        next_check = max(self.next_expiry(), last_check + self.check_interval)
+        timeout = max(0, next_check - time.monotonic()) if self.expiry else None
+        if self.snapshot_path:
+          timeout = max(0, min(timeout if timeout is not None else self.snapshot_interval,
+                               next_snapshot - time.monotonic()))
+        # Пока готовятся ответы управляющего сокета или снимок, не спим, а чередуем порции с приемом пакетов
+        if self.snapshot_job or any(conn.chunks and len(conn.outbuf) < CONTROL_BUFFER
+                                    for conn in self.control.values()):
+          timeout = 0
+        for key, mask in selector.select(timeout):
+          if key.data is None:
+            self.receive_all(server_socket)
+          else:
+            key.data(selector, key.fileobj, mask)
+        self.produce_control(selector)
 
-          # Парсим полученные данные
+        if self.snapshot_job:
           try:
-              heartbeat_data = json.loads(data.decode())
-              sequence = heartbeat_data['sequence']
-              timestamp = heartbeat_data['timestamp']
-
-              # Вычисляем RTT
-              rtt = (current_time - timestamp) * 1000  # в миллисекундах
-
-              # Обновляем информацию о клиенте
-              if client_address not in self.clients:
-                  self.clients[client_address] = {
-                      'last_sequence': sequence,
-                      'last_seen': current_time,
-                      'packets_received': 1,
-                      'min_rtt': rtt,
-                      'max_rtt': rtt,
-                      'total_rtt': rtt
-                  }
-              else:
-                  client = self.clients[client_address]
-                  expected_sequence = client['last_sequence'] + 1
-
-                  if sequence != expected_sequence:
-                      lost_packets = sequence - expected_sequence
-                      print(f'Потеряно пакетов 
-от {client_address}: {lost_packets}')
-                      
-                  client['last_sequence'] = sequence
-                  client['last_seen'] = current_time
-                  client['packets_received'] += 1
-                  client['min_rtt'] = min(client['min_rtt'], rtt)
-                  client['max_rtt'] = max(client['max_rtt'], rtt)
-                  client['total_rtt'] += rtt
-                  
-              print(f'Получен heartbeat от {client_address}, seq={sequence}, 
-RTT={rtt:.2f}ms')
-              
-          except json.JSONDecodeError:
-              print(f'Получены некорректные данные от {client_address}')
-                
-        except socket.timeout:
-            pass
-            
-        # Проверяем таймауты клиентов
-        current_time = time.time()
-        for addr, client in list(self.clients.items()):
-            if current_time - client['last_seen'] > self.timeout:
-                print(f'Клиент {addr} отключился (таймаут)')
-                print(f'Статистика клиента:')
-                print(f'Получено пакетов: {client["packets_received"]}')
-                print(f'RTT min/avg/max = '
-                      f'{client["min_rtt"]:.2f}/'
-                      f'{(client["total_rtt"]/client["packets_received"]):.2f}/'
-                      f'{client["max_rtt"]:.2f} ms')
-                del self.clients[addr]
-                
-        time.sleep(0.1)  # Небольшая задержка для снижения нагрузки на CPU
-          
+            next(self.snapshot_job)
+          except StopIteration:
+            self.snapshot_job = None
+        now = time.monotonic()
+        if self.snapshot_path and not self.snapshot_job and not self.snapshot_writing() and now >= next_snapshot:
+          self.snapshot_job = self.write_snapshot()
+          next_snapshot = now + self.snapshot_interval
+
+        if now >= max(self.next_expiry(), last_check + self.check_interval):
+          self.check_timeouts(now)
+          last_check = now
+
     except KeyboardInterrupt:
-        print("\nСервер остановлен")
-        server_socket.close()
-        sys.exit(0)
+      print("\nСервер остановлен")
+      if self.snapshot_path:
+        # Последний снимок дописываем целиком, чтобы после перезапуска продолжить с актуального состояния
+        if self.snapshot_job:
+          self.snapshot_job.close()  # Недописанный снимок отменяется
+          self.snapshot_job = None
+        self.wait_snapshot()
+        for _ in self.write_snapshot():
+          pass
+        self.wait_snapshot()
+      selector.close()
+      server_socket.close()
+      if control_socket:
+        control_socket.close()
+        if self.control_path:
+          os.unlink(self.control_path)
+      sys.exit(0)
+
+  def receive_all(self, server_socket):
+    """Забирает все готовые датаграммы (не больше MAX_BATCH за раз)"""
+    for _ in range(MAX_BATCH):
+      try:
+        received, client_address = server_socket.recvfrom_into(self.buffer)
+      except (BlockingIOError, InterruptedError):
+        return
+      except OSError:
+        # ICMP-ошибка от одного из клиентов, остальные пакеты в очереди не трогаем
+        continue
+      self.handle_heartbeat(self.buffer[:received], client_address, time.time(), time.monotonic())
+
+  def handle_heartbeat(self, data, client_address, current_time, now):
+    # Парсим полученные данные
+    try:
+      sequence, timestamp = parse_heartbeat(data)
+    except ValueError:
+      self.invalid_packets += 1
+      if self.should_log():
+        print(f'Получены некорректные данные от {client_address}')
+      return
+
+    # Вычисляем RTT
+    rtt = (current_time - timestamp) * 1000  # в миллисекундах
+
+    # Обновляем информацию о клиенте
+    client = self.clients.get(client_address)
+    if client is None:
+      self.clients[client_address] = ClientState(sequence, now, rtt)
+      heapq.heappush(self.expiry, (now + self.timeout, client_address))
+    else:
+      lost_packets = client.record(sequence, now, rtt)
+      if lost_packets and self.should_log():
+        print(f'Потеряно пакетов от {client_address}: {lost_packets}')
+    self.fleet.record(rtt)
+    self.packets_received += 1
+
+    if self.should_log():
+      print(f'Получен heartbeat от {client_address}, seq={sequence}, RTT={rtt:.2f}ms')
+
+  def should_log(self):
+    """Выборочное логирование: печать на каждое событие при тысячах пакетов в секунду тормозит сервер"""
+    if not self.log_every:
+      return False
+    self.log_counter += 1
+    return self.log_counter % self.log_every == 0
+
+  def next_expiry(self):
+    return self.expiry[0][0] if self.expiry else float('inf')
+
+  def check_timeouts(self, now):
+    # Проверяем таймауты только тех клиентов, чей срок по куче уже наступил
+    expiry = self.expiry
+    while expiry and expiry[0][0] <= now:
+      _, addr = heapq.heappop(expiry)
+      client = self.clients[addr]
+      deadline = client.last_seen + self.timeout
+      if deadline > now:
+        # Клиент присылал heartbeat после постановки в кучу - переносим срок
+        heapq.heappush(expiry, (deadline, addr))
+      else:
+        print(f'Клиент {addr} отключился (таймаут)')
+        print(f'Статистика клиента:')
+        print(f'Получено пакетов: {client.packets_received}, потеряно: {client.lost}, '
+              f'не по порядку: {client.reordered}')
+        print(f'RTT min/avg/max = '
+              f'{client.min_rtt:.2f}/'
+              f'{(client.total_rtt/client.packets_received):.2f}/'
+              f'{client.max_rtt:.2f} ms')
+        print(f'RTT p50/p99/p999 = {client.histogram.percentile(50):.2f}/'
+              f'{client.histogram.percentile(99):.2f}/{client.histogram.percentile(99.9):.2f} ms, '
+              f'jitter = {client.jitter:.2f} ms')
+        del self.clients[addr]
+        self.clients_expired += 1
+
+  @staticmethod
+  def handle_sigterm(signum, frame):
+    # SIGTERM обрабатываем как Ctrl+C, чтобы сохранить финальный снимок
+    raise KeyboardInterrupt
+
+  def write_snapshot(self):
+    """
+    Генератор снимка: таблица клиентов упаковывается порциями между обработкой пакетов,
+    а запись в файл, fsync и атомарная замена предыдущего снимка идут в отдельном потоке
+    """
+    # Копия словаря не создает объектов на каждого клиента (в отличие от списка пар) и не вызывает сборку мусора
+    clients = self.clients.copy()
+    # last_seen хранится в monotonic - переводим в unix time одной поправкой на весь снимок
+    offset = time.time() - time.monotonic()
+    chunks = queue.Queue(SNAPSHOT_QUEUE)
+    self.snapshot_thread = threading.Thread(target=self.snapshot_writer, args=(chunks, len(clients)), daemon=True)
+    self.snapshot_thread.start()
+
+    fleet = self.fleet
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, int(sys.byteorder == 'big'), time.time(),
+                                  self.packets_received, self.clients_expired, self.invalid_packets, len(clients),
+                                  fleet.base, len(fleet.counts)) + fleet.counts.tobytes()
+    # Копия опустошается по мере упаковки: иначе освобождение словаря на миллион записей - отдельная пауза в конце
+    records = (b''.join(client.pack(addr, client.last_seen + offset)
+                        for addr, client in (clients.popitem() for _ in range(min(SNAPSHOT_CHUNK, len(clients)))))
+               for _ in range(0, len(clients), SNAPSHOT_CHUNK))
+    finished = False
+    try:
+      # None - конец снимка
+      for chunk in itertools.chain([header], records, [None]):
+        # Если поток записи не успевает, не ждем его, а возвращаемся к обработке пакетов
+        while True:
+          try:
+            chunks.put_nowait(chunk)
+            break
+          except queue.Full:
+            yield
+        yield
+      finished = True
+    finally:
+      if not finished:
+        chunks.put(False)
+
+  def snapshot_writer(self, chunks, count):
+    """
+    Поток записи снимка: порции из очереди пишутся во временный файл, затем fsync и os.replace.
+    False в очереди отменяет снимок. После ошибки очередь все равно вычитывается до конца,
+    чтобы генератор снимка не ждал места в ней
+    """
+    tmp_path = self.snapshot_path + '.tmp'
+    started = time.perf_counter()
+    chunk = b''
+    try:
+      with open(tmp_path, 'wb') as f:
+        while True:
+          chunk = chunks.get()
+          if chunk is None or chunk is False:
+            break
+          f.write(chunk)
+        if chunk is None:
+          f.flush()
+          os.fsync(f.fileno())
+      if chunk is None:
+        os.replace(tmp_path, self.snapshot_path)
+      else:
+        os.unlink(tmp_path)
+    except OSError as e:
+      print(f'[!] Не удалось записать снимок {self.snapshot_path}: {e}')
+      while chunk is not None and chunk is not False:
+        chunk = chunks.get()
+      return
+    if chunk is None and count >= 100000:
+      print(f'[*] Снимок {count} клиентов записан за {time.perf_counter() - started:.2f} с')
+
+  def snapshot_writing(self):
+    return self.snapshot_thread is not None and self.snapshot_thread.is_alive()
+
+  def wait_snapshot(self):
+    """Ожидание завершения записи текущего снимка"""
+    if self.snapshot_thread:
+      self.snapshot_thread.join()
+
+  def load_snapshot(self):
+    """Восстанавливает клиентов из снимка; клиенты, чей таймаут истек, пока сервер был остановлен, отбрасываются"""
+    try:
+      with open(self.snapshot_path, 'rb') as f:
+        data = f.read()
+    except FileNotFoundError:
+      return
+
+    started = time.perf_counter()
+    # Миллионы новых объектов запускают полные сборки мусора, которые и без того нечего освобождать
+    gc.disable()
+    try:
+      (magic, version, big_endian, _, packets_received, clients_expired, invalid_packets, count,
+       fleet_base, fleet_length) = SNAPSHOT_HEADER.unpack_from(data)
+      if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError('неизвестный формат')
+      swap = big_endian != (sys.byteorder == 'big')
+      view = memoryview(data)
+      offset = SNAPSHOT_HEADER.size
+
+      def read_counts(offset, length):
+        counts = array('I')
+        counts.frombytes(view[offset:offset + 4 * length])
+        if swap:
+          counts.byteswap()
+        return counts
+
+      fleet = LatencyHistogram.restore(fleet_base, read_counts(offset, fleet_length))
+      offset += 4 * fleet_length
+      # Время последнего heartbeat переводим обратно в monotonic текущего процесса
+      to_monotonic = time.monotonic() - time.time()
+      deadline = time.time() - self.timeout
+      clients = {}
+      expiry = []
+      unpack_from = SNAPSHOT_RECORD.unpack_from
+      record_size = SNAPSHOT_RECORD.size
+      for _ in range(count):
+        fields = unpack_from(data, offset)
+        offset += record_size
+        addr, client, last_seen = ClientState.unpack(fields, read_counts(offset, fields[-1]))
+        offset += 4 * fields[-1]
+        if last_seen <= deadline:
+          clients_expired += 1
+          continue
+        client.last_seen = last_seen + to_monotonic
+        clients[addr] = client
+        expiry.append((client.last_seen + self.timeout, addr))
+    except (ValueError, struct.error) as e:
+      print(f'[!] Не удалось загрузить снимок {self.snapshot_path}: {e}')
+      return
+    finally:
+      gc.enable()
+
+    heapq.heapify(expiry)
+    self.clients, self.expiry, self.fleet = clients, expiry, fleet
+    self.packets_received, self.clients_expired, self.invalid_packets = packets_received, clients_expired, invalid_packets
+    print(f'[*] Из снимка восстановлено клиентов: {len(clients)} из {count} '
+          f'за {time.perf_counter() - started:.2f} с')
+
+  def fleet_summary(self):
+    """Сводка по всем клиентам: гистограмма поддерживается на лету, поэтому запрос стоит O(число корзин)"""
+    return dict(clients=len(self.clients), clients_expired=self.clients_expired,
+                packets_received=self.packets_received, invalid_packets=self.invalid_packets,
+                **self.fleet.percentiles())
+
+  def print_fleet(self):
+    summary = self.fleet_summary()
+    print(f'[*] Клиентов: {summary["clients"]} (отключилось: {summary["clients_expired"]}), '
+          f'пакетов: {summary["packets_received"]}, RTT p50/p99/p999 = '
+          f'{summary["p50"]:.2f}/{summary["p99"]:.2f}/{summary["p999"]:.2f} ms', flush=True)
+
+  def open_control(self):
+    if self.control_path:
+      if os.path.exists(self.control_path):
+        os.unlink(self.control_path)
+      control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      control_socket.bind(self.control_path)
+      where = self.control_path
+    elif self.control_port:
+      control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      control_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+      control_socket.bind(('127.0.0.1', self.control_port))
+      where = f'127.0.0.1:{self.control_port}'
+    else:
+      return None
+    control_socket.listen(16)
+    control_socket.setblocking(False)
+    print(f'Управляющий сокет: {where} (GET /, /clients, /metrics)')
+    return control_socket
+
+  def accept_control(self, selector, control_socket, mask):
+    try:
+      sock, _ = control_socket.accept()
+    except (BlockingIOError, InterruptedError):
+      return
+    sock.setblocking(False)
+    self.control[sock] = ControlConnection(sock)
+    selector.register(sock, selectors.EVENT_READ, self.on_control_event)
+
+  def on_control_event(self, selector, sock, mask):
+    conn = self.control[sock]
+    try:
+      if mask & selectors.EVENT_READ:
+        data = sock.recv(4096)
+        if not data:
+          self.close_control(selector, conn)
+          return
+        # Остаток HTTP-запроса после первой строки не нужен
+        if conn.chunks is None:
+          conn.inbuf += data
+          if b'\n' in conn.inbuf:
+            # Понимаем как HTTP-запрос (для curl и Prometheus), так и просто строку с путем
+            line = conn.inbuf.split(b'\n', 1)[0].decode('latin-1').split()
+            path = line[1] if len(line) > 1 and line[0] == 'GET' else (line[0] if line else '/')
+            conn.chunks = self.control_response(path)
+          elif len(conn.inbuf) > 4096:
+            self.close_control(selector, conn)
+            return
+      if mask & selectors.EVENT_WRITE and conn.outbuf:
+        sent = sock.send(conn.outbuf)
+        del conn.outbuf[:sent]
+    except (BlockingIOError, InterruptedError):
+      pass
+    except OSError:
+      self.close_control(selector, conn)
+
+  def produce_control(self, selector):
+    """Готовит по одной порции ответа для каждого соединения, не давая буферу разрастись"""
+    for conn in list(self.control.values()):
+      if conn.chunks is None:
+        continue
+      if conn.chunks and len(conn.outbuf) < CONTROL_BUFFER:
+        chunk = next(conn.chunks, None)
+        if chunk is None:
+          conn.chunks = False  # Ответ готов, осталось дописать буфер
+        else:
+          conn.outbuf += chunk.encode()
+      if conn.chunks is False and not conn.outbuf:
+        self.close_control(selector, conn)
+      elif conn.outbuf:
+        selector.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, self.on_control_event)
+
+  def close_control(self, selector, conn):
+    selector.unregister(conn.sock)
+    conn.sock.close()
+    del self.control[conn.sock]
+
+  def control_response(self, path):
+    """Генератор ответа: заголовки, затем тело порциями по SNAPSHOT_CHUNK клиентов"""
+    route, _, query = path.partition('?')
+    if route == '/':
+      yield self.http_header('application/json') + json.dumps(self.fleet_summary(), indent=2) + '\n'
+    elif route == '/clients':
+      yield self.http_header('application/json') + '[\n'
+      separator = ''
+      for chunk in self.client_chunks():
+        yield separator + ',\n'.join(
+          json.dumps(dict(client=f'{addr[0]}:{addr[1]}', status=self.client_status(age),
+                          last_seen_ago=round(age, 3), **client.summary()))
+          for addr, client, age in chunk)
+        separator = ',\n'
+      yield '\n]\n'
+    elif route == '/metrics':
+      yield self.http_header('text/plain; version=0.0.4') + self.prometheus_fleet()
+      if 'clients=1' in query:
+        for chunk in self.client_chunks():
+          yield ''.join(self.prometheus_client(addr, client, age) for addr, client, age in chunk)
+    else:
+      yield 'HTTP/1.0 404 Not Found\r\nConnection: close\r\n\r\nНеизвестный путь\n'
+
+  def client_chunks(self):
+    """Снимок списка клиентов на момент запроса, выдаваемый порциями между обработкой пакетов"""
+    # Как и в write_snapshot: копия словаря дешевле списка пар на миллион клиентов
+    clients = self.clients.copy()
+    items = iter(clients.items())
+    for _ in range(0, len(clients), SNAPSHOT_CHUNK):
+      now = time.monotonic()
+      yield [(addr, client, now - client.last_seen) for addr, client in itertools.islice(items, SNAPSHOT_CHUNK)]
+
+  def client_status(self, age):
+    return 'active' if age <= self.timeout / 2 else 'stale'
+
+  @staticmethod
+  def http_header(content_type):
+    return f'HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\nConnection: close\r\n\r\n'
+
+  def prometheus_fleet(self):
+    summary = self.fleet_summary()
+    lines = [
+      '# HELP heartbeat_clients Число активных клиентов', '# TYPE heartbeat_clients gauge',
+      f'heartbeat_clients {summary["clients"]}',
+      '# HELP heartbeat_clients_expired_total Клиенты, отключенные по таймауту',
+      '# TYPE heartbeat_clients_expired_total counter',
+      f'heartbeat_clients_expired_total {summary["clients_expired"]}',
+      '# HELP heartbeat_invalid_packets_total Некорректные пакеты', '# TYPE heartbeat_invalid_packets_total counter',
+      f'heartbeat_invalid_packets_total {summary["invalid_packets"]}',
+      '# HELP heartbeat_rtt_milliseconds RTT heartbeat по всем клиентам', '# TYPE heartbeat_rtt_milliseconds summary',
+      f'heartbeat_rtt_milliseconds{{quantile="0.5"}} {summary["p50"]}',
+      f'heartbeat_rtt_milliseconds{{quantile="0.99"}} {summary["p99"]}',
+      f'heartbeat_rtt_milliseconds{{quantile="0.999"}} {summary["p999"]}',
+      f'heartbeat_rtt_milliseconds_count {summary["packets_received"]}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+  @staticmethod
+  def prometheus_client(addr, client, age):
+    label = f'client="{addr[0]}:{addr[1]}"'
+    summary = client.summary()
+    return (f'heartbeat_client_packets_received_total{{{label}}} {summary["packets_received"]}\n'
+            f'heartbeat_client_packets_lost_total{{{label}}} {summary["lost"]}\n'
+            f'heartbeat_client_packets_reordered_total{{{label}}} {summary["reordered"]}\n'
+            f'heartbeat_client_jitter_milliseconds{{{label}}} {summary["jitter"]:.3f}\n'
+            f'heartbeat_client_rtt_milliseconds{{{label},quantile="0.5"}} {summary["p50"]}\n'
+            f'heartbeat_client_rtt_milliseconds{{{label},quantile="0.99"}} {summary["p99"]}\n'
+            f'heartbeat_client_last_seen_seconds{{{label}}} {age:.3f}\n')
 
 if __name__ == '__main__':
-  port = 12000  # Порт по умолчанию
-  if len(sys.argv) == 2:
-      port = int(sys.argv[1])
-  
-  server = HeartbeatServer(port)
-  server.start()
\ No newline at end of file
+  parser = argparse.ArgumentParser(description='UDP Heartbeat сервер')
+  parser.add_argument('port', nargs='?', type=int, default=12000, help='Порт (по умолчанию 12000)')
+  parser.add_argument('-t', '--timeout', type=float, default=10, help='Таймаут клиента, сек')
+  parser.add_argument('--check-interval', type=float,
+                      help='Интервал проверки таймаутов, сек (по умолчанию десятая часть таймаута, не больше 1)')
+  parser.add_argument('-v', '--verbose', action='store_true', help='Печатать каждый полученный heartbeat')
+  parser.add_argument('--log-sample', type=float, default=0.0,
+                      help='Доля heartbeat и сообщений о потерях, которые печатаются (например, 0.001)')
+  parser.add_argument('--control-port', type=int, help='TCP-порт управляющего сокета на 127.0.0.1')
+  parser.add_argument('--control-socket', help='Путь Unix-сокета для управления (вместо TCP-порта)')
+  parser.add_argument('--snapshot', help='Файл снимка таблицы клиентов: загружается при старте и обновляется периодически')
+  parser.add_argument('--snapshot-interval', type=float, default=10, help='Интервал записи снимка, сек')
+  args = parser.parse_args()
+
+  server = HeartbeatServer(args.port, args.timeout, args.check_interval, 1.0 if args.verbose else args.log_sample,
+                           args.control_port, args.control_socket, args.snapshot, args.snapshot_interval)
+  server.start()
@@ -1,7 +1,19 @@
 import socket
 import time
-import sys
+import struct
+import select
+import csv
+import json
+import argparse
 import statistics
+from collections import deque
+
+# Формат пакета быстрого режима: номер пакета и время отправки в наносекундах (perf_counter_ns)
+PACKET = struct.Struct('!IQ')
+RECV_SIZE = 65535
+
+# Состояния пакета в быстром режиме
+WAITING, RECEIVED, EXPIRED = 1, 2, 3
 
 def ping(host, port, count=4):
     # Создаем UDP сокет
@@ -61,11 +73,340 @@ def ping(host, port, count=4):
         else:
             print('Нет успешных ответов')
 
+class PingStats:
+    """Статистика быстрого режима для одной цели"""
+    def __init__(self, count):
+        self.state = bytearray(count)  # Состояние каждого пакета по номеру
+        self.in_flight = 0
+        self.sent = 0
+        self.received = 0
+        self.lost = 0  # Не дождались ответа за таймаут
+        self.late = 0  # Ответ пришел уже после таймаута
+        self.duplicates = 0
+        self.reordered = 0  # Ответ пришел после ответа на более поздний пакет
+        self.invalid = 0
+        self.highest = -1
+        self.rtts = []  # RTT полученных вовремя ответов, мс
+
+    def on_send(self, seq):
+        self.state[seq] = WAITING
+        self.in_flight += 1
+        self.sent += 1
+
+    def on_reply(self, data, now):
+        if len(data) < PACKET.size:
+            self.invalid += 1
+            return
+        seq, sent_at = PACKET.unpack_from(data)
+        if seq >= len(self.state) or not self.state[seq]:
+            self.invalid += 1
+            return
+
+        state = self.state[seq]
+        if state == RECEIVED:
+            self.duplicates += 1
+            return
+        if state == EXPIRED:
+            self.late += 1
+            self.state[seq] = RECEIVED
+            return
+
+        self.state[seq] = RECEIVED
+        self.in_flight -= 1
+        self.received += 1
+        self.rtts.append((now - sent_at) / 1e6)
+        if seq < self.highest:
+            self.reordered += 1
+        else:
+            self.highest = seq
+
+    def expire(self, seq):
+        """Отмечает пакет потерянным, если ответ на него так и не пришел"""
+        if self.state[seq] == WAITING:
+            self.state[seq] = EXPIRED
+            self.in_flight -= 1
+            self.lost += 1
+
+    def summary(self):
+        rtts = self.rtts
+        result = {
+            'sent': self.sent, 'received': self.received, 'lost': self.lost, 'late': self.late,
+            'duplicates': self.duplicates, 'reordered': self.reordered, 'invalid': self.invalid,
+            'loss': (self.sent - self.received) / self.sent * 100 if self.sent else 0.0,
+        }
+        if rtts:
+            result.update(min=min(rtts), avg=statistics.mean(rtts), max=max(rtts),
+                          mdev=statistics.pstdev(rtts))
+            # Джиттер - среднее изменение RTT между соседними ответами
+            result['jitter'] = (sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)
+                                if len(rtts) > 1 else 0.0)
+        return result
+
+def expire_pending(pending, now, timeout_ns):
+    """
+    Проверяет таймауты отправленных пакетов
+    :param pending: очередь (статистика цели, номер, время отправки) в порядке отправки
+    :return: время следующей проверки или None, если очередь пуста
+    """
+    while pending:
+        stats, seq, sent_at = pending[0]
+        # Пакеты, на которые уже пришел ответ, просто убираем из очереди
+        if stats.state[seq] == WAITING and now - sent_at < timeout_ns:
+            return sent_at + timeout_ns
+        pending.popleft()
+        stats.expire(seq)
+    return None
+
+def windowed_ping(host, port, count=100, interval=0.01, window=16, timeout=1.0, size=PACKET.size):
+    """
+    Быстрый режим: пакеты уходят с заданным интервалом, не дожидаясь ответов,
+    но в полете одновременно не больше window пакетов
+    """
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_socket.setblocking(False)
+    address = (socket.gethostbyname(host), port)
+
+    stats = PingStats(count)
+    pending = deque()
+    padding = b'\x00' * max(0, size - PACKET.size)
+    buffer = bytearray(RECV_SIZE)
+    interval_ns = int(interval * 1e9)
+    timeout_ns = int(timeout * 1e9)
+
+    print(f'PING {host}:{port}: {count} пакетов, интервал {interval * 1000:g} мс, окно {window}')
+    started = time.perf_counter_ns()
+    next_send = started
+
+    try:
+        while stats.sent < count or stats.in_flight:
+            now = time.perf_counter_ns()
+            next_expiry = expire_pending(pending, now, timeout_ns)
+
+            # Отправляем все пакеты, время которых подошло, пока позволяет окно
+            while stats.sent < count and stats.in_flight < window and now >= next_send:
+                seq = stats.sent
+                try:
+                    client_socket.sendto(PACKET.pack(seq, now) + padding, address)
+                except BlockingIOError:
+                    break
+                stats.on_send(seq)
+                pending.append((stats, seq, now))
+                next_send += interval_ns
+                if next_expiry is None:
+                    next_expiry = now + timeout_ns
+
+            # Ждем ответа не дольше, чем до следующей отправки или истечения таймаута
+            deadline = next_expiry or now + timeout_ns
+            if stats.sent < count and stats.in_flight < window:
+                deadline = min(deadline, next_send)
+            wait = max(0, deadline - time.perf_counter_ns()) / 1e9
+            readable, _, _ = select.select([client_socket], [], [], wait)
+            if not readable:
+                continue
+
+            # Забираем все накопившиеся ответы за одно пробуждение
+            while True:
+                try:
+                    received, server = client_socket.recvfrom_into(buffer)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+                stats.on_reply(buffer[:received], time.perf_counter_ns())
+
+    except KeyboardInterrupt:
+        print("\nПинг прерван")
+
+    finally:
+        client_socket.close()
+
+    elapsed = (time.perf_counter_ns() - started) / 1e9
+    print_summary(f'{host}:{port}', stats.summary(), elapsed)
+    return stats
+
+def load_targets(path, default_port):
+    """Читает список целей: по одной на строку в виде хост:порт, хост порт или просто хост"""
+    targets = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if ' ' in line:
+                host, port = line.split()
+            elif line.count(':') == 1:
+                host, port = line.split(':')
+            else:
+                host, port = line, default_port
+            targets.append((host, int(port)))
+    return targets
+
+def fanout_ping(targets, count=10, rate=1000, timeout=1.0, sockets=1, size=PACKET.size):
+    """
+    Пингует много целей одновременно из нескольких неблокирующих сокетов.
+    Пакеты рассылаются по кругу с общим ограничением rate пакетов в секунду,
+    ответы разбираются по адресу отправителя и номеру пакета
+    :return: список (цель, статистика) в порядке целей
+    """
+    results = []
+    by_address = {}
+    for host, port in targets:
+        try:
+            address = (socket.gethostbyname(host), port)
+        except socket.gaierror as e:
+            print(f'[!] {host}: не удалось разрешить имя ({e})')
+            continue
+        if address in by_address:
+            continue
+        stats = PingStats(count)
+        by_address[address] = stats
+        results.append((f'{host}:{port}', address, stats))
+
+    sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(max(1, sockets))]
+    for sock in sockets:
+        sock.setblocking(False)
+
+    pending = deque()
+    padding = b'\x00' * max(0, size - PACKET.size)
+    buffer = bytearray(RECV_SIZE)
+    interval_ns = int(1e9 / rate)
+    timeout_ns = int(timeout * 1e9)
+    total = len(results) * count
+    unknown = 0
+
+    print(f'PING {len(results)} целей по {count} пакетов, до {rate} пакетов/с, сокетов: {len(sockets)}')
+    started = time.perf_counter_ns()
+    next_send = started
+    index = 0  # Номер следующей отправки: цель index % целей, пакет index // целей
+
+    try:
+        while index < total or pending:
+            now = time.perf_counter_ns()
+            next_expiry = expire_pending(pending, now, timeout_ns)
+            if index >= total and not pending:
+                break
+
+            # Отправляем не больше пачки за раз, чтобы не задерживать прием ответов
+            burst = 0
+            while index < total and now >= next_send and burst < 256:
+                target, address, stats = results[index % len(results)]
+                seq = index // len(results)
+                try:
+                    sockets[index % len(sockets)].sendto(PACKET.pack(seq, now) + padding, address)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    # Цель недостижима - пакет считается отправленным и потерянным
+                    pass
+                stats.on_send(seq)
+                pending.append((stats, seq, now))
+                index += 1
+                burst += 1
+                next_send += interval_ns
+                if next_expiry is None:
+                    next_expiry = now + timeout_ns
+
+            deadline = next_expiry or now + timeout_ns
+            if index < total:
+                deadline = min(deadline, next_send)
+            wait = max(0, deadline - time.perf_counter_ns()) / 1e9
+            readable, _, _ = select.select(sockets, [], [], wait)
+
+            for sock in readable:
+                while True:
+                    try:
+                        received, server = sock.recvfrom_into(buffer)
+                    except (BlockingIOError, ConnectionRefusedError):
+                        break
+                    stats = by_address.get(server)
+                    if stats is None:
+                        unknown += 1
+                        continue
+                    stats.on_reply(buffer[:received], time.perf_counter_ns())
+
+    except KeyboardInterrupt:
+        print("\nПинг прерван")
+
+    finally:
+        for sock in sockets:
+            sock.close()
+
+    elapsed = (time.perf_counter_ns() - started) / 1e9
+    print(f'[*] Отправлено {index} пакетов за {elapsed:.2f} с ({index / elapsed:.0f} пакетов/с)')
+    if unknown:
+        print(f'[!] Ответов с неизвестных адресов: {unknown}')
+    return [(target, stats) for target, _, stats in results]
+
+def print_table(results):
+    print(f'\n{"Цель":<28}{"Отпр":>7}{"Получ":>7}{"Потери":>8}{"min":>9}{"avg":>9}{"max":>9}'
+          f'{"jitter":>9}{"late":>6}{"dup":>6}{"reord":>6}')
+    for target, stats in results:
+        summary = stats.summary()
+        rtt = ''.join(f'{summary[key]:>9.3f}' if key in summary else f'{"-":>9}'
+                      for key in ('min', 'avg', 'max', 'jitter'))
+        print(f'{target:<28}{summary["sent"]:>7}{summary["received"]:>7}{summary["loss"]:>7.1f}%{rtt}'
+              f'{summary["late"]:>6}{summary["duplicates"]:>6}{summary["reordered"]:>6}')
+
+def save_results(results, csv_path=None, json_path=None):
+    rows = [dict(target=target, **stats.summary()) for target, stats in results]
+    if csv_path:
+        fields = ['target', 'sent', 'received', 'lost', 'late', 'duplicates', 'reordered', 'invalid',
+                  'loss', 'min', 'avg', 'max', 'mdev', 'jitter']
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f'[*] Результаты сохранены в {csv_path}')
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+        print(f'[*] Результаты сохранены в {json_path}')
+
+def print_summary(target, summary, elapsed):
+    print(f'\n--- Статистика пинга {target} ---')
+    print(f'Packets: Sent = {summary["sent"]}, Received = {summary["received"]}, '
+          f'Lost = {summary["sent"] - summary["received"]} ({summary["loss"]:.1f}% loss), '
+          f'Late = {summary["late"]}, Duplicates = {summary["duplicates"]}, '
+          f'Reordered = {summary["reordered"]}')
+    if summary['invalid']:
+        print(f'Некорректных ответов: {summary["invalid"]}')
+    if 'avg' in summary:
+        print(f'RTT min/avg/max/mdev = {summary["min"]:.3f}/{summary["avg"]:.3f}/'
+              f'{summary["max"]:.3f}/{summary["mdev"]:.3f} ms, jitter = {summary["jitter"]:.3f} ms')
+    else:
+        print('Нет успешных ответов')
+    if elapsed > 0:
+        print(f'Скорость отправки: {summary["sent"] / elapsed:.0f} пакетов/с за {elapsed:.2f} с')
+
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print('Использование: python udp_ping_client.py хост порт')
-        sys.exit(1)
-        
-    host = sys.argv[1]
-    port = int(sys.argv[2])
-    ping(host, port)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='UDP пинг-клиент')
+    parser.add_argument('host', nargs='?', help='Хост сервера')
+    parser.add_argument('port', nargs='?', type=int, default=12000, help='Порт сервера')
+    parser.add_argument('-c', '--count', type=int, help='Число пакетов (4 в обычном режиме, 100 в быстром)')
+    parser.add_argument('-w', '--window', type=int,
+                        help='Быстрый режим: максимум пакетов в полете без ответа')
+    parser.add_argument('-i', '--interval', type=float, default=0.01,
+                        help='Интервал между пакетами в быстром режиме, сек (можно меньше миллисекунды)')
+    parser.add_argument('-W', '--timeout', type=float, default=1.0,
+                        help='Через сколько секунд пакет без ответа считается потерянным')
+    parser.add_argument('-s', '--size', type=int, default=PACKET.size,
+                        help=f'Размер пакета в быстром режиме, байт (не меньше {PACKET.size})')
+    parser.add_argument('-t', '--targets',
+                        help='Файл со списком целей (хост:порт на строку) для одновременного пинга всех')
+    parser.add_argument('-r', '--rate', type=int, default=1000,
+                        help='Общий лимит отправки при пинге списка целей, пакетов/с')
+    parser.add_argument('--sockets', type=int, default=1, help='Число сокетов при пинге списка целей')
+    parser.add_argument('--csv', help='Сохранить результаты по целям в CSV')
+    parser.add_argument('--json', help='Сохранить результаты по целям в JSON')
+    args = parser.parse_args()
+
+    if args.targets:
+        results = fanout_ping(load_targets(args.targets, args.port), args.count or 10, args.rate,
+                              args.timeout, args.sockets, args.size)
+        print_table(results)
+        save_results(results, args.csv, args.json)
+    elif args.host is None:
+        parser.error('нужно указать хост или файл целей --targets')
+    elif args.window is None:
+        ping(args.host, args.port, args.count or 4)
+    else:
+        windowed_ping(args.host, args.port, args.count or 100, args.interval, max(1, args.window),
+                      args.timeout, args.size)
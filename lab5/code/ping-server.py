@@ -1,5 +1,12 @@
 import socket
 import sys
+import os
+import time
+import signal
+import argparse
+import traceback
+
+MAX_DATAGRAM = 65507  # Максимальный размер полезной нагрузки UDP по IPv4
 
 def start_server(port):
     # Создаем UDP сокет
@@ -22,8 +29,124 @@ def start_server(port):
         server_socket.close()
         sys.exit(0)
 
+def create_socket(port, reuse_port=False, rcvbuf=None, sndbuf=None):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if reuse_port:
+        # Каждый воркер открывает свой сокет на том же порту, ядро распределяет датаграммы между ними
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # Большие буферы сокета сглаживают всплески, пока воркер занят
+    if rcvbuf:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    server_socket.bind(('', port))
+    return server_socket
+
+def echo_worker(worker_id, server_socket, max_size=MAX_DATAGRAM, stats_interval=1.0):
+    """Эхо-цикл воркера: прием в заранее выделенный буфер и периодический вывод пакетов/байт в секунду"""
+    buffer = bytearray(max_size)
+    view = memoryview(buffer)
+    # Таймаут нужен, чтобы печатать статистику и при отсутствии пакетов
+    server_socket.settimeout(stats_interval)
+    packets = 0
+    total_bytes = 0
+    report_at = time.monotonic() + stats_interval
+
+    while True:
+        try:
+            received, client_address = server_socket.recvfrom_into(buffer)
+            server_socket.sendto(view[:received], client_address)
+            packets += 1
+            total_bytes += received
+        except socket.timeout:
+            pass
+        except OSError as e:
+            # Ошибка одного клиента (например, ICMP unreachable) не должна останавливать воркер
+            print(f'[!] Воркер {worker_id}: {e}')
+
+        now = time.monotonic()
+        if now >= report_at:
+            elapsed = now - report_at + stats_interval
+            if packets:
+                print(f'[*] Воркер {worker_id} (pid {os.getpid()}): {packets / elapsed:.0f} пакетов/с, '
+                      f'{total_bytes / elapsed / 1e6:.2f} МБ/с', flush=True)
+            packets = 0
+            total_bytes = 0
+            report_at = now + stats_interval
+
+def start_workers(port, workers, max_size=MAX_DATAGRAM, rcvbuf=None, sndbuf=None, stats_interval=1.0):
+    """Высокопроизводительный режим: несколько процессов на одном порту через SO_REUSEPORT"""
+    if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+        print('[!] Режим воркеров требует SO_REUSEPORT и os.fork')
+        sys.exit(1)
+
+    print(f'UDP Пинг-сервер запущен на порту {port} (воркеров: {workers}, '
+          f'максимальный размер датаграммы: {max_size})')
+    pids = []
+    for worker_id in range(workers):
+        pid = os.fork()
+        if pid:
+            pids.append(pid)
+            continue
+        # Ctrl+C получает вся группа процессов, воркер просто завершается
+        exit_code = 0
+        try:
+            echo_worker(worker_id, create_socket(port, True, rcvbuf, sndbuf), max_size, stats_interval)
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    workers_left = dict(zip(pids, range(workers)))
+    failed = 0
+    while workers_left:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except KeyboardInterrupt:
+            stop(signal.SIGINT, None)
+            continue
+        except ChildProcessError:
+            break
+        worker_id = workers_left.pop(pid)
+        exit_code = os.waitstatus_to_exitcode(status)
+        # Завершение по нашему SIGTERM при остановке сервера - штатное
+        if exit_code and not (stopping and exit_code == -signal.SIGTERM):
+            print(f'[!] Воркер {worker_id} (pid {pid}) завершился с кодом {exit_code}')
+            failed += 1
+    print("\nСервер остановлен")
+    if failed:
+        sys.exit(1)
+
 if __name__ == '__main__':
-    port = 12000  # Порт по умолчанию
-    if len(sys.argv) == 2:
-        port = int(sys.argv[1])
-    start_server(port)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='UDP эхо-сервер для пинга')
+    parser.add_argument('port', nargs='?', type=int, default=12000, help='Порт (по умолчанию 12000)')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Высокопроизводительный режим: число процессов на одном порту (SO_REUSEPORT)')
+    parser.add_argument('--max-size', type=int, default=MAX_DATAGRAM,
+                        help='Максимальный размер датаграммы, байт (длиннее будут обрезаны)')
+    parser.add_argument('--rcvbuf', type=int, help='Размер буфера приема сокета (SO_RCVBUF), байт')
+    parser.add_argument('--sndbuf', type=int, help='Размер буфера отправки сокета (SO_SNDBUF), байт')
+    parser.add_argument('--stats-interval', type=float, default=1.0,
+                        help='Интервал вывода статистики воркеров, сек')
+    args = parser.parse_args()
+
+    if args.workers:
+        start_workers(args.port, args.workers, min(args.max_size, MAX_DATAGRAM), args.rcvbuf, args.sndbuf,
+                      args.stats_interval)
+    else:
+        start_server(args.port)
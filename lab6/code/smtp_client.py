@@ -3,26 +3,41 @@ import ssl
 import base64
 import mimetypes
 import os
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.mime.base import MIMEBase
-from email import encoders
+import csv
+import json
+import time
+import queue
+import threading
+import uuid
+from string import Template
+from email.header import Header
+from email.utils import formatdate, encode_rfc2231
 import argparse
 from getpass import getpass
 from dotenv import load_dotenv
 from pathlib import Path
 
+DATA_CHUNK_SIZE = 64 * 1024    # Порог накопления данных письма перед записью в сокет
+BASE64_CHUNK_SIZE = 57 * 1024  # Кратно 57 байтам - из порции получаются целые строки base64 по 76 символов
+
 class SMTPClient:
     def __init__(self, server="smtp.gmail.com", port=587):
         self.server = server
         self.port = port
         self.client_socket = None
         self.ssl_socket = None
+        self.last_response = ''
+        self.verbose = True
+        self.buffer = bytearray()  # Принятые, но еще не разобранные байты ответов
+        self.esmtp_features = {}   # Расширения из ответа EHLO: {'SIZE': '35882577', 'PIPELINING': '', ...}
+        self.recipient_results = {}  # Ответ сервера на RCPT TO для каждого получателя последнего письма
     
     def connect(self):
         """Установка начального TCP-соединения"""
         try:
+            self.ssl_socket = None
+            self.buffer.clear()
+            self.esmtp_features = {}
             self.client_socket = socket(AF_INET, SOCK_STREAM)
             self.client_socket.connect((self.server, self.port))
             response = self.receive_response()
@@ -37,7 +52,7 @@ class SMTPClient:
         try:
             # Сначала выполняем EHLO
             client_fqdn = self.get_fqdn()
-            if not self.send_command(f"EHLO {client_fqdn}", '250'):
+            if not self.ehlo(client_fqdn):
                 # Если EHLO не сработал, пробуем HELO
                 if not self.send_command(f"HELO {client_fqdn}", '250'):
                     print("Ошибка: Не удалось выполнить EHLO/HELO")
@@ -50,9 +65,11 @@ class SMTPClient:
             context = ssl.create_default_context()
             self.ssl_socket = context.wrap_socket(self.client_socket, 
                                                 server_hostname=self.server)
+            # Данные, полученные до TLS, доверять нельзя (RFC 3207)
+            self.buffer.clear()
             
-            # После установки TLS нужно снова выполнить EHLO
-            if not self.send_command(f"EHLO {client_fqdn}", '250'):
+            # После установки TLS нужно снова выполнить EHLO, список расширений меняется
+            if not self.ehlo(client_fqdn):
                 print("Ошибка: Не удалось выполнить EHLO после TLS")
                 return False
                 
@@ -62,6 +79,21 @@ class SMTPClient:
             print(f"Ошибка при установке TLS: {e}")
             return False
 
+    def ehlo(self, client_fqdn):
+        """EHLO с разбором списка расширений сервера в self.esmtp_features"""
+        self.esmtp_features = {}
+        if not self.send_command(f"EHLO {client_fqdn}", '250'):
+            return False
+        # Первая строка - приветствие сервера, остальные - по одному расширению
+        for line in self.last_response.splitlines()[1:]:
+            keyword, _, params = line[4:].partition(' ')
+            self.esmtp_features[keyword.upper()] = params.strip()
+        return True
+
+    def has_extension(self, name):
+        """Объявил ли сервер расширение в последнем ответе на EHLO"""
+        return name.upper() in self.esmtp_features
+
     def get_fqdn(self):
         """Получение полного доменного имени или IP-адреса"""
         try:
@@ -123,76 +155,144 @@ class SMTPClient:
             print(f"Ошибка при аутентификации: {e}")
             return False
 
-    def send_email(self, from_addr, to_addr, subject, message, attachments=None):
-        """Отправка email с вложениями"""
+    def send_email(self, from_addr, to_addr, subject, message, attachments=None, cc=None, bcc=None):
+        """
+        Отправка email с вложениями одной транзакцией всем получателям.
+        to_addr, cc и bcc - адрес, строка адресов через запятую или список;
+        Bcc попадает только в конверт (RCPT TO), но не в заголовки.
+        Ответ на RCPT TO для каждого адреса сохраняется в self.recipient_results,
+        письмо считается отправленным, если его принял хотя бы один получатель
+        """
+        self.recipient_results = {}
         try:
-            # Создаем MIME-сообщение
-            msg = MIMEMultipart()
-            msg['From'] = from_addr
-            msg['To'] = to_addr
-            msg['Subject'] = subject
-
-            # Добавляем текст
-            msg.attach(MIMEText(message, 'plain'))
-
-            # Добавляем вложения
-            if attachments:
-                for file_path in attachments:
-                    if os.path.exists(file_path):
-                        content_type, _ = mimetypes.guess_type(file_path)
-                        maintype, subtype = content_type.split('/') if content_type else ('application', 'octet-stream')
-
-                        with open(file_path, 'rb') as f:
-                            if maintype == 'image':
-                                img = MIMEImage(f.read(), _subtype=subtype)
-                                img.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
-                                msg.attach(img)
-                            else:
-                                part = MIMEBase(maintype, subtype)
-                                part.set_payload(f.read())
-                                encoders.encode_base64(part)
-                                part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
-                                msg.attach(part)
-
-            # Отправляем MAIL FROM
-            if not self.send_command(f"MAIL FROM:<{from_addr}>", '250'):
+            to_list, cc_list, bcc_list = address_list(to_addr), address_list(cc), address_list(bcc)
+            # Один адрес в нескольких списках получает письмо один раз
+            recipients = list(dict.fromkeys(to_list + cc_list + bcc_list))
+            if not recipients:
+                print("Ошибка: не указан ни один получатель")
                 return False
-
-            # Отправляем RCPT TO
-            if not self.send_command(f"RCPT TO:<{to_addr}>", '250'):
+            # Проверяем до MAIL FROM, чтобы не оставлять на сервере начатую транзакцию
+            check_header_value('From', from_addr)
+            check_header_value('Subject', subject)
+            for address in recipients:
+                check_header_value('адресе получателя', address)
+
+            commands = [(f"MAIL FROM:<{from_addr}>", '250')]
+            commands += [(f"RCPT TO:<{address}>", '250') for address in recipients]
+            commands.append(("DATA", '354'))
+            if self.has_extension('PIPELINING'):
+                # Вся группа уходит одной записью, ответы читаются по порядку (RFC 2920)
+                responses = self.send_pipelined(commands)
+            else:
+                responses = []
+                for command, expected_code in commands:
+                    self.send_command(command, expected_code)
+                    responses.append(self.last_response)
+                    # После отказа на MAIL FROM или всем получателям DATA отправлять незачем
+                    if not responses[0].startswith('250'):
+                        break
+                    if len(responses) == len(commands) - 1 and not any(
+                            accepted_reply(response) for response in responses[1:]):
+                        break
+                responses += [''] * (len(commands) - len(responses))
+
+            self.recipient_results = {address: response.strip() for address, response in zip(recipients, responses[1:-1])}
+            rejected = [address for address, reply in self.recipient_results.items() if not accepted_reply(reply)]
+            if rejected:
+                print("Отклонены получатели: " + ', '.join(
+                    f"{address} ({self.recipient_results[address] or 'нет ответа'})" for address in rejected))
+
+            if not responses[-1].startswith('354'):
                 return False
-
-            # Отправляем DATA
-            if not self.send_command("DATA", '354'):
+            if not responses[0].startswith('250') or len(rejected) == len(recipients):
+                # Сервер ждет текст письма, хотя конверт не принят - завершаем пустое письмо
+                self.send_raw('.\r\n')
+                self.receive_response()
                 return False
 
-            # Отправляем содержимое письма
-            email_content = msg.as_string() + '\r\n.\r\n'
-            self.ssl_socket.send(email_content.encode())
+            # Письмо формируется по частям прямо во время отправки, вложения читаются порциями
+            self.send_data(iter_message(from_addr, to_list, cc_list, subject, message, attachments))
             
             # Проверяем финальный ответ
             if not self.check_response('250'):
                 print("Ошибка: Сервер не подтвердил получение письма")
                 return False
 
-            print("Письмо успешно отправлено!")
+            if self.verbose:
+                print("Письмо успешно отправлено!")
             return True
 
         except Exception as e:
             print(f"Ошибка при отправке письма: {e}")
             return False
 
+    def send_data(self, chunks):
+        """
+        Передача текста письма после DATA с завершающей строкой '.'.
+        Точка в начале строки удваивается на лету (RFC 5321, 4.5.2), данные уходят
+        в сокет через sendall, как только накопится DATA_CHUNK_SIZE байт
+        :param chunks: итератор порций письма в байтах со строками, оканчивающимися CRLF
+        """
+        socket_to_use = self.ssl_socket if self.ssl_socket else self.client_socket
+        pending = bytearray()
+        line_start = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if line_start and chunk[:1] == b'.':
+                pending += b'.'
+            pending += chunk.replace(b'\n.', b'\n..')
+            line_start = chunk.endswith(b'\n')
+            if len(pending) >= DATA_CHUNK_SIZE:
+                socket_to_use.sendall(pending)
+                pending.clear()
+        if not line_start:
+            pending += b'\r\n'
+        pending += b'.\r\n'
+        socket_to_use.sendall(pending)
+
+    def open_session(self, username, password):
+        """Подключение, STARTTLS и аутентификация одним вызовом"""
+        if self.connect() and self.start_tls() and self.login(username, password):
+            return True
+        self.close()
+        return False
+
+    def reset(self):
+        """Сброс текущей транзакции (RSET) без закрытия сессии"""
+        return self.send_command("RSET", '250')
+
+    def connection_lost(self):
+        """Сервер закрыл соединение или сообщил о закрытии (421)"""
+        return self.last_response[:3] in ('421', '')
+
+    def close(self):
+        """Закрытие сокетов без QUIT (для уже оборванной сессии)"""
+        for sock in (self.ssl_socket, self.client_socket):
+            if sock:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+        self.ssl_socket = None
+        self.client_socket = None
+
     def quit(self):
         """Завершение сессии"""
         try:
             if self.ssl_socket:
-                self.send_command("QUIT")
+                self.send_command("QUIT", '221')
                 self.ssl_socket.close()
             if self.client_socket:
                 self.client_socket.close()
         except Exception as e:
             print(f"Ошибка при закрытии соединения: {e}")
 
+    def send_raw(self, data):
+        """Запись строки целиком в текущий сокет (TLS, если он уже установлен)"""
+        socket_to_use = self.ssl_socket if self.ssl_socket else self.client_socket
+        socket_to_use.sendall(data.encode())
+
     def send_command(self, command, expected_code='250', hide_in_logs=False):
         """
         Отправка команды на сервер
@@ -201,41 +301,92 @@ class SMTPClient:
         :param hide_in_logs: Скрывать ли команду в логах (для паролей)
         """
         try:
-            socket_to_use = self.ssl_socket if self.ssl_socket else self.client_socket
-            socket_to_use.send((command + '\r\n').encode())
+            self.send_raw(command + '\r\n')
             
             # Получаем ответ
             response = self.receive_response(hide_in_logs)
-            
-            # Проверяем код ответа
-            response_code = response[:3] if response else ''
-            
-            # Логируем результат
-            if not hide_in_logs:
-                if response_code != expected_code:
-                    print(f"Команда: {command}")
-                    print(f"Ожидался код: {expected_code}")
-                    print(f"Получен ответ: {response.strip()}")
-            
-            return response_code == expected_code
+            return self.check_code(command, expected_code, response, hide_in_logs)
             
         except Exception as e:
             print(f"Ошибка при отправке команды: {e}")
+            self.last_response = ''
             return False
+
+    def send_pipelined(self, commands):
+        """
+        Отправка группы команд одной записью (расширение PIPELINING)
+        :param commands: список пар (команда, ожидаемый код)
+        :return: список ответов в порядке команд ('' - ответа нет)
+        """
+        try:
+            self.send_raw(''.join(command + '\r\n' for command, _ in commands))
+        except Exception as e:
+            print(f"Ошибка при отправке команды: {e}")
+            self.last_response = ''
+            return [''] * len(commands)
+
+        responses = []
+        for command, expected_code in commands:
+            response = self.receive_response()
+            self.check_code(command, expected_code, response)
+            responses.append(response)
+            if not response or response.startswith('421'):
+                # Соединение оборвано или сервер его закрывает, остальных ответов не будет
+                responses.extend([''] * (len(commands) - len(responses)))
+                break
+        return responses
+
+    def check_code(self, command, expected_code, response, hide_in_logs=False):
+        """Сравнение кода ответа с ожидаемым и вывод подробностей при несовпадении"""
+        response_code = response[:3] if response else ''
+        
+        # Логируем результат
+        if not hide_in_logs:
+            if response_code != expected_code:
+                print(f"Команда: {command}")
+                print(f"Ожидался код: {expected_code}")
+                print(f"Получен ответ: {response.strip()}")
+        
+        return response_code == expected_code
+
+    def read_line(self):
+        """Чтение одной строки ответа через буфер (без CRLF)"""
+        socket_to_use = self.ssl_socket if self.ssl_socket else self.client_socket
+        while True:
+            end = self.buffer.find(b'\r\n')
+            if end >= 0:
+                line = self.buffer[:end].decode(errors='replace')
+                del self.buffer[:end + 2]
+                return line
+            chunk = socket_to_use.recv(4096)
+            if not chunk:
+                raise ConnectionError("сервер закрыл соединение")
+            self.buffer += chunk
+
+    def read_reply(self):
+        """
+        Чтение полного (в т.ч. многострочного) ответа: строки вида '250-...'
+        продолжаются до строки с пробелом после кода ('250 ...')
+        """
+        lines = [self.read_line()]
+        while lines[-1][3:4] == '-':
+            lines.append(self.read_line())
+        return lines
             
     def receive_response(self, hide_in_logs=False):
         """Получение ответа от сервера"""
         try:
-            socket_to_use = self.ssl_socket if self.ssl_socket else self.client_socket
-            response = socket_to_use.recv(1024).decode()
+            response = '\r\n'.join(self.read_reply()) + '\r\n'
+            self.last_response = response
             
-            if not hide_in_logs:
+            if not hide_in_logs and self.verbose:
                 print(f"Ответ сервера: {response.strip()}")
                 
             return response
             
         except Exception as e:
             print(f"Ошибка при получении ответа: {e}")
+            self.last_response = ''
             return ''
 
     def check_response(self, expected_code):
@@ -243,6 +394,319 @@ class SMTPClient:
         response = self.receive_response()
         return response.startswith(expected_code)
 
+def encode_header(name, value):
+    """
+    Значение заголовка, перенесенное через CRLF на строки до 78 символов; не-ASCII символы кодируются по RFC 2047.
+    ASCII без пробелов перенести нельзя - такое значение тоже кодируется, закодированные слова можно разбивать
+    """
+    if value.isascii():
+        encoded = Header(value, header_name=name).encode(linesep='\r\n')
+        if all(len(line) <= 998 - len(name) - 2 for line in encoded.split('\r\n')):
+            return encoded
+    return Header(value, 'utf-8', header_name=name).encode(linesep='\r\n')
+
+def check_header_value(name, value):
+    """CR или LF в теме или адресе позволили бы подставить свои заголовки письма или команды SMTP"""
+    if '\r' in value or '\n' in value:
+        raise ValueError(f"перевод строки в {name}: {value!r}")
+
+def fold_addresses(name, addresses):
+    """
+    Заголовок со списком адресов, перенесенный по границам ', ' на строки до 78 символов.
+    Строка заголовка длиннее 998 символов запрещена RFC 5322
+    """
+    lines = [f"{name}: {addresses[0]}"]
+    for address in addresses[1:]:
+        if len(lines[-1]) + len(address) + 2 > 78:
+            lines[-1] += ','
+            lines.append(' ' + address)
+        else:
+            lines[-1] += ', ' + address
+    return '\r\n'.join(lines)
+
+def iter_base64(f):
+    """Кодирование файла в base64 порциями по BASE64_CHUNK_SIZE байт"""
+    while True:
+        chunk = f.read(BASE64_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+
+def iter_message(from_addr, to_list, cc_list, subject, message, attachments=None):
+    """
+    Генератор письма multipart/mixed по частям: заголовки, текст и вложения.
+    Вложения не читаются в память целиком, поэтому расход памяти не зависит от их размера.
+    Несуществующие файлы вложений пропускаются
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+    headers = [f"From: {from_addr}",
+               fold_addresses('To', to_list) if to_list else 'To: undisclosed-recipients:;']
+    if cc_list:
+        headers.append(fold_addresses('Cc', cc_list))
+    headers += [f"Subject: {encode_header('Subject', subject)}",
+                f"Date: {formatdate(localtime=True)}",
+                "MIME-Version: 1.0",
+                f'Content-Type: multipart/mixed; boundary="{boundary}"']
+    yield ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+    # Текст письма: ASCII с короткими строками уходит как есть, остальное - в base64
+    lines = message.splitlines()
+    if message.isascii() and all(len(line) <= 998 for line in lines):
+        yield (f"--{boundary}\r\n"
+               'Content-Type: text/plain; charset="us-ascii"\r\n'
+               "Content-Transfer-Encoding: 7bit\r\n\r\n").encode()
+        yield ''.join(line + '\r\n' for line in lines).encode()
+    else:
+        yield (f"--{boundary}\r\n"
+               'Content-Type: text/plain; charset="utf-8"\r\n'
+               "Content-Transfer-Encoding: base64\r\n\r\n").encode()
+        yield base64.encodebytes(message.encode()).replace(b'\n', b'\r\n')
+
+    for file_path in attachments or []:
+        if not os.path.exists(file_path):
+            continue
+        content_type, _ = mimetypes.guess_type(file_path)
+        filename = os.path.basename(file_path)
+        if filename.isascii():
+            disposition = f'attachment; filename="{filename}"'
+        else:
+            disposition = f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+        yield (f"--{boundary}\r\n"
+               f"Content-Type: {content_type or 'application/octet-stream'}\r\n"
+               "Content-Transfer-Encoding: base64\r\n"
+               f"Content-Disposition: {disposition}\r\n\r\n").encode()
+        with open(file_path, 'rb') as f:
+            yield from iter_base64(f)
+
+    yield f"--{boundary}--\r\n".encode()
+
+def address_list(addresses):
+    """Список адресов из строки через запятую, списка или None"""
+    if not addresses:
+        return []
+    if isinstance(addresses, str):
+        addresses = addresses.split(',')
+    return [address.strip() for address in addresses if address.strip()]
+
+def accepted_reply(reply):
+    """Принят ли получатель: 250 или 251 (адрес будет переслан)"""
+    return reply[:3] in ('250', '251')
+
+class BulkSender:
+    """
+    Рассылка множества писем через одну авторизованную сессию SMTPClient.
+    Между письмами отправляется RSET, соединение, TLS и AUTH повторяются только
+    когда сервер закрыл сессию или исчерпан лимит писем на сессию
+    """
+    def __init__(self, client, username, password, max_per_session=0):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.max_per_session = max_per_session  # 0 - без ограничения
+        self.connected = False
+        self.session_messages = 0  # Писем (в т.ч. неудачных) в текущей сессии
+        self.sessions = 0
+
+    def open(self):
+        """Новая сессия: соединение, STARTTLS, аутентификация"""
+        self.connected = self.client.open_session(self.username, self.password)
+        self.session_messages = 0
+        if self.connected:
+            self.sessions += 1
+        return self.connected
+
+    def reconnect(self):
+        """Закрытие текущей сессии и открытие новой"""
+        if self.connected and not self.client.connection_lost():
+            self.client.quit()
+        self.client.close()
+        self.connected = False
+        return self.open()
+
+    def send(self, to_addr, subject, message, attachments=None, cc=None, bcc=None):
+        """
+        Отправка одного письма в текущей сессии.
+        Если сервер закрыл соединение (или отказал временной ошибкой 4xx после
+        нескольких писем - так обычно выглядит лимит на сессию), письмо
+        отправляется повторно в новой сессии
+        """
+        for attempt in range(2):
+            if not self.connected and not self.open():
+                return False
+            if self.max_per_session and self.session_messages >= self.max_per_session:
+                if not self.reconnect():
+                    return False
+            # RSET сбрасывает состояние после предыдущего письма (в т.ч. неудачного)
+            if self.session_messages and not self.client.reset():
+                if not (self.client.connection_lost() and self.reconnect()):
+                    return False
+
+            ok = self.client.send_email(self.username, to_addr, subject, message, attachments, cc, bcc)
+            self.session_messages += 1
+            if ok:
+                return True
+
+            limit_reached = self.client.last_response.startswith('4') and self.session_messages > 1
+            if attempt == 0 and (self.client.connection_lost() or limit_reached):
+                print(f"Сессия прервана ({self.client.last_response.strip() or 'соединение закрыто'}), переподключение")
+                self.client.close()
+                self.connected = False
+                continue
+            return False
+        return False
+
+    def close(self):
+        if self.connected:
+            self.client.quit()
+        self.client.close()
+        self.connected = False
+
+def load_recipients(path):
+    """
+    Чтение списка получателей из CSV (строка заголовков обязательна) или JSONL.
+    В каждой записи должно быть поле email, необязательные cc и bcc (адреса через запятую)
+    задают копии письма, остальные поля доступны в шаблоне
+    """
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    for number, row in enumerate(rows, 1):
+        if not row.get('email'):
+            raise ValueError(f"{path}: в записи {number} нет поля email")
+    return rows
+
+def render_template(template, fields):
+    """Подстановка полей получателя в шаблон вида 'Здравствуйте, $name!'"""
+    return Template(template).safe_substitute(fields)
+
+def send_batch(sender, recipients, subject, message, attachments=None):
+    """
+    Рассылка по списку получателей
+    :return: число успешно отправленных писем
+    """
+    sent = 0
+    started = time.perf_counter()
+    for number, row in enumerate(recipients, 1):
+        ok = sender.send(row['email'], render_template(subject, row), render_template(message, row), attachments,
+                         row.get('cc'), row.get('bcc'))
+        sent += ok
+        print(f"[{number}/{len(recipients)}] {row['email']}: {'отправлено' if ok else 'ошибка'}")
+    elapsed = time.perf_counter() - started
+    print(f"Отправлено {sent} из {len(recipients)} писем за {elapsed:.2f} с, сессий: {sender.sessions}")
+    return sent
+
+class RateLimiter:
+    """Общий для всех потоков лимит писем в минуту: письма равномерно распределяются по времени"""
+    def __init__(self, per_minute=0):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Ожидание очередного разрешенного момента отправки"""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+class ParallelSender:
+    """
+    Рассылка через пул параллельных авторизованных сессий.
+    Каждый поток держит свою сессию (BulkSender с RSET и переподключением)
+    и берет письма из общей очереди. Число одновременных сессий с сервером
+    и число писем в минуту ограничиваются независимо от размера пула
+    """
+    def __init__(self, server, port, username, password, sessions=4, max_per_server=0, per_minute=0,
+                 max_per_session=0, verbose=False):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sessions = sessions
+        self.max_per_session = max_per_session
+        self.verbose = verbose
+        self.server_slots = threading.BoundedSemaphore(max_per_server or sessions)
+        self.rate = RateLimiter(per_minute)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()  # Для results, счетчика сессий и вывода
+        self.results = []
+        self.total = 0
+        self.sessions_opened = 0
+
+    def worker(self, subject, message, attachments):
+        client = SMTPClient(self.server, self.port)
+        client.verbose = self.verbose
+        sender = BulkSender(client, self.username, self.password, self.max_per_session)
+        # Слот сервера занят, пока поток держит сессию
+        with self.server_slots:
+            try:
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        break
+                    number, row = item
+                    self.rate.wait()
+                    started = time.perf_counter()
+                    ok = sender.send(row['email'], render_template(subject, row), render_template(message, row),
+                                     attachments, row.get('cc'), row.get('bcc'))
+                    self.report(number, row['email'], ok, client, time.perf_counter() - started)
+            finally:
+                sender.close()
+                with self.lock:
+                    self.sessions_opened += sender.sessions
+
+    def report(self, number, email, ok, client, seconds):
+        """Сохранение и вывод результата по одному письму"""
+        reply = client.last_response.strip().splitlines()[-1] if client.last_response.strip() else 'соединение закрыто'
+        rejected = [address for address, response in client.recipient_results.items() if not accepted_reply(response)]
+        result = {'number': number, 'email': email, 'status': 'sent' if ok else 'failed',
+                  'reply': reply, 'rejected': ' '.join(rejected), 'time_ms': round(seconds * 1000, 1)}
+        with self.lock:
+            self.results.append(result)
+            print(f"[{number}/{self.total}] {email}: {'отправлено' if ok else 'ошибка'} "
+                  f"({reply}, {seconds * 1000:.0f} мс)")
+
+    def run(self, recipients, subject, message, attachments=None):
+        """
+        Рассылка по списку получателей
+        :return: результаты по письмам в порядке списка
+        """
+        self.total = len(recipients)
+        for item in enumerate(recipients, 1):
+            self.queue.put(item)
+        # По одному маркеру завершения на поток
+        for _ in range(self.sessions):
+            self.queue.put(None)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.worker, args=(subject, message, attachments), daemon=True)
+                   for _ in range(self.sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.results.sort(key=lambda result: result['number'])
+        sent = sum(result['status'] == 'sent' for result in self.results)
+        rate = len(self.results) / elapsed * 60 if elapsed else 0.0
+        print(f"Отправлено {sent} из {self.total} писем за {elapsed:.2f} с "
+              f"({rate:.0f} писем/мин), потоков: {self.sessions}, сессий: {self.sessions_opened}")
+        return self.results
+
+def save_report(results, path):
+    """Сохранение результатов рассылки по письмам в CSV"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['number', 'email', 'status', 'reply', 'rejected', 'time_ms'])
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Результаты сохранены в {path}")
+
 def load_env_config():
     """Загрузка конфигурации из .env файла"""
     # Пытаемся найти .env файл в текущей директории или родительских директориях
@@ -276,14 +740,34 @@ def main():
     parser.add_argument('--server', default=config['server'], help='SMTP сервер')
     parser.add_argument('--port', type=int, default=config['port'], help='Порт сервера')
     parser.add_argument('--username', default=config['username'], help='Email отправителя')
-    parser.add_argument('--to', default=config['default_to'], help='Email получателя')
+    parser.add_argument('--to', default=config['default_to'], help='Email получателя (несколько - через запятую)')
+    parser.add_argument('--cc', help='Получатели копии через запятую')
+    parser.add_argument('--bcc', help='Получатели скрытой копии через запятую (не видны в заголовках)')
     parser.add_argument('--subject', required=True, help='Тема письма')
-    parser.add_argument('--message', required=True, help='Текст письма')
+    parser.add_argument('--message', help='Текст письма')
     parser.add_argument('--attachments', nargs='*', help='Пути к файлам вложений')
     parser.add_argument('--no-env', action='store_true', help='Игнорировать .env файл')
+    parser.add_argument('--batch', help='Рассылка: CSV или JSONL со списком получателей (поле email и поля для шаблона)')
+    parser.add_argument('--template', help='Файл с шаблоном текста письма для рассылки ($name - поле получателя)')
+    parser.add_argument('--max-per-session', type=int, default=0,
+                        help='Лимит писем на одну SMTP-сессию при рассылке (0 - без ограничения)')
+    parser.add_argument('--sessions', type=int, default=1,
+                        help='Число параллельных SMTP-сессий при рассылке')
+    parser.add_argument('--max-per-server', type=int, default=0,
+                        help='Лимит одновременных сессий с сервером (0 - равен --sessions)')
+    parser.add_argument('--rate', type=int, default=0, help='Лимит писем в минуту при рассылке (0 - без ограничения)')
+    parser.add_argument('--report', help='CSV-файл для результатов рассылки по каждому письму')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Выводить ответы сервера при рассылке')
 
     args = parser.parse_args()
 
+    if args.template:
+        with open(args.template, encoding='utf-8') as f:
+            args.message = f.read()
+    if args.message is None:
+        print("Ошибка: не указан текст письма (--message или --template)")
+        return
+
     # Определяем пароль
     password = None
     if not args.no_env and config['password']:
@@ -298,13 +782,30 @@ def main():
         print("Ошибка: не указан email отправителя")
         return
     
-    if not args.to:
-        print("Ошибка: не указан email получателя")
-        return
-
     # Создаем клиент
     client = SMTPClient(args.server, args.port)
 
+    if args.batch:
+        recipients = load_recipients(args.batch)
+        if args.sessions > 1 or args.rate or args.report:
+            pool = ParallelSender(args.server, args.port, args.username, password, args.sessions,
+                                  args.max_per_server, args.rate, args.max_per_session, args.verbose)
+            results = pool.run(recipients, args.subject, args.message, args.attachments)
+            if args.report:
+                save_report(results, args.report)
+            return
+        client.verbose = args.verbose
+        sender = BulkSender(client, args.username, password, args.max_per_session)
+        try:
+            send_batch(sender, recipients, args.subject, args.message, args.attachments)
+        finally:
+            sender.close()
+        return
+
+    if not (args.to or args.cc or args.bcc):
+        print("Ошибка: не указан email получателя")
+        return
+
     try:
         # Устанавливаем соединение
         if not client.connect():
@@ -319,8 +820,10 @@ def main():
             return
 
         # Отправляем письмо
-        if client.send_email(args.username, args.to, args.subject, args.message, args.attachments):
+        if client.send_email(args.username, args.to, args.subject, args.message, args.attachments, args.cc, args.bcc):
             print("Письмо успешно отправлено!")
+            for address, reply in client.recipient_results.items():
+                print(f"  {address}: {reply}")
         else:
             print("Ошибка при отправке письма")
 
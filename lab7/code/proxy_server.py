@@ -254,7 +254,7 @@ class ProxyServer:
             # Создаем соединение
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.settimeout(10)
-            s.connect((host, port))
+            s.connect((parsed_url.hostname, port))
             
             # Формируем запрос
             request = f"{method} {path} HTTP/1.1\r\n"